@@ -0,0 +1,242 @@
+"""
+Benchmarks of the hot paths of the firmware, runs on CPython and on the
+MicroPython unix port:
+
+    python3 benchmark/bench.py           # compare against baselines.json
+    micropython benchmark/bench.py
+    python3 benchmark/bench.py --save    # store the current numbers as baseline
+
+Reports operations per second and heap bytes per operation. On MicroPython
+the gc is disabled while measuring, so the gc.mem_alloc() delta is every
+byte allocated. CPython frees most temporaries right away, there it is
+the tracemalloc peak of one extra call, the most memory an operation holds
+at once including what it keeps.
+
+Only the few hardware modules the measured code imports are faked here
+(and only if missing), sim/ is CPython only.
+"""
+import gc
+import json
+import sys
+import time
+
+BENCH_DIR = __file__.rsplit("/", 1)[0] if "/" in __file__ else "."
+SRC_DIR = BENCH_DIR + "/../src"
+BASELINES = BENCH_DIR + "/baselines.json"
+HISTORY_DIR = BENCH_DIR + "/history" # HistoryLog segments, removed after the run
+TOLERANCE = 0.3 # allowed relative slowdown / allocation growth before failing
+_tracemalloc = None # set on CPython, MicroPython has gc.mem_alloc()
+
+
+class _Module:
+    pass
+
+
+class _UART:
+    def __init__(self, *args, **kwargs):
+        pass
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+    def any(self):
+        return 0
+
+    def write(self, data):
+        return len(data)
+
+    def readinto(self, buf):
+        return None
+
+
+class _NeoPixel:
+    def __init__(self, n):
+        self.pixels = [(0, 0, 0)] * n
+        self.writes = 0
+
+    def __len__(self):
+        return len(self.pixels)
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = color
+
+    def write(self):
+        self.writes += 1
+
+
+class _DirectionSensor:
+    direction = 0
+
+    def tick(self):
+        pass
+
+
+class _Sensor:
+    ppm = 1234
+
+
+def _install_fakes():
+    if not hasattr(time, "ticks_us"):
+        time.ticks_us = lambda: time.perf_counter_ns() // 1000
+        time.ticks_ms = lambda: time.perf_counter_ns() // 1000000
+        time.ticks_diff = lambda a, b: a - b
+        time.ticks_add = lambda a, b: a + b
+    if not hasattr(gc, "mem_alloc"):
+        global _tracemalloc
+        import tracemalloc
+        tracemalloc.start()
+        _tracemalloc = tracemalloc
+        gc.mem_alloc = lambda: tracemalloc.get_traced_memory()[0]
+        gc.mem_free = lambda: 0
+    machine = _Module()
+    machine.UART = _UART
+    machine.Pin = lambda *args, **kwargs: None
+    machine.I2C = machine.SoftI2C = lambda *args, **kwargs: None
+    sys.modules["machine"] = machine
+    for alias, module in (("ustruct", "struct"), ("utime", "time"), ("uasyncio", "asyncio")):
+        try:
+            __import__(alias)
+        except ImportError:
+            sys.modules[alias] = __import__(module)
+    try:
+        import micropython
+    except ImportError:
+        micropython = _Module()
+        micropython.const = lambda value: value
+        sys.modules["micropython"] = micropython
+    uasyncio = sys.modules.get("uasyncio") or __import__("uasyncio")
+    if not hasattr(uasyncio.StreamReader, "readinto"):
+        # CPython asyncio streams are never used by the measured code
+        uasyncio_fake = _Module()
+        uasyncio_fake.__dict__.update(uasyncio.__dict__)
+        uasyncio_fake.StreamReader = lambda *args, **kwargs: None
+        sys.modules["uasyncio"] = uasyncio_fake
+
+
+def _remove_history():
+    import os
+    try:
+        names = os.listdir(HISTORY_DIR)
+    except OSError:
+        return
+    for name in names:
+        os.remove(HISTORY_DIR + "/" + name)
+    os.rmdir(HISTORY_DIR)
+
+
+def measure(name, function, iterations):
+    function() # warm up caches and lazily created objects
+    gc.collect()
+    gc.disable()
+    alloc = gc.mem_alloc()
+    start = time.ticks_us()
+    for _ in range(iterations):
+        function()
+    duration = time.ticks_diff(time.ticks_us(), start)
+    allocated = max(gc.mem_alloc() - alloc, 0) // iterations
+    gc.enable()
+    gc.collect()
+    if _tracemalloc is not None:
+        _tracemalloc.reset_peak()
+        before = _tracemalloc.get_traced_memory()[0]
+        function()
+        allocated = _tracemalloc.get_traced_memory()[1] - before
+    ops = iterations * 1000000 / max(duration, 1)
+    return {"ops_per_s": int(ops), "bytes_per_op": allocated}
+
+
+def benchmarks():
+    from display import Display
+    from ringbuffer import RingBuffer, TieredHistory
+    from historylog import HistoryLog
+    import mhz19
+
+    steady = Display(_NeoPixel(25), _Sensor(), _DirectionSensor(), brightness=20)
+    steady.state = "display"
+    steady.tick_base -= 5000 # no fading pixel, the frame does not change
+    animated = Display(_NeoPixel(25), _Sensor(), _DirectionSensor(), brightness=20)
+    animated.state = "warmup"
+
+    sensor = mhz19.MHZ19(2, tx=33, rx=23)
+    reply = bytearray(b"\xff\x86\x04\xd2\x3e\x00\x00\x00\x00")
+    reply[8] = mhz19.crc8(reply)
+
+    def parse():
+        sensor._rx[:] = reply
+        sensor._feed(9)
+
+    ring = RingBuffer(4800)
+    history = TieredHistory()
+    for i in range(history.minutes.max_size):
+        history.append(400 + i % 800)
+
+    _remove_history()
+    log = HistoryLog(HISTORY_DIR) # what /history and /history.bin stream at resolution 1
+    for i in range(log.capacity):
+        log.append(400 + i % 800, 20, 1700000000 + i * 60)
+    log.flush()
+
+    def history_json():
+        for _ in log.iter_json():
+            pass
+
+    def history_binary():
+        for _ in log.iter_binary():
+            pass
+
+    return (
+        ("display_update_steady", steady.update, 2000),
+        ("display_update_animated", animated.update, 2000),
+        ("mhz19_parse", parse, 5000),
+        ("mhz19_crc8", lambda: mhz19.crc8(reply), 20000),
+        ("ringbuffer_append", lambda: ring.append(1234), 20000),
+        ("tiered_history_append", lambda: history.append(1234), 10000),
+        ("history_log_json", history_json, 5),
+        ("history_log_binary", history_binary, 20),
+    )
+
+
+def load_baselines():
+    try:
+        with open(BASELINES) as baseline_file:
+            return json.load(baseline_file)
+    except (OSError, ValueError):
+        return {}
+
+
+def main():
+    _install_fakes()
+    sys.path.insert(0, SRC_DIR)
+    save = "--save" in sys.argv
+    implementation = sys.implementation.name
+    baselines = load_baselines()
+    baseline = baselines.get(implementation, {})
+    results = {}
+    regressions = 0
+    print("%-26s %12s %10s   %s" % ("benchmark", "ops/s", "bytes/op", "vs baseline"))
+    for name, function, iterations in benchmarks():
+        result = measure(name, function, iterations)
+        results[name] = result
+        comparison = "no baseline"
+        if name in baseline:
+            speed = result["ops_per_s"] / max(baseline[name]["ops_per_s"], 1)
+            comparison = "%.2fx speed, %+d bytes/op" % (speed, result["bytes_per_op"] - baseline[name]["bytes_per_op"])
+            if speed < 1 - TOLERANCE or result["bytes_per_op"] > baseline[name]["bytes_per_op"] * (1 + TOLERANCE) + 16:
+                comparison += "  REGRESSION"
+                regressions += 1
+        print("%-26s %12d %10d   %s" % (name, result["ops_per_s"], result["bytes_per_op"], comparison))
+    _remove_history()
+    if save:
+        baselines[implementation] = results
+        with open(BASELINES, "w") as baseline_file:
+            json.dump(baselines, baseline_file)
+        print("saved baseline for", implementation)
+    elif regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
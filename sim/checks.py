@@ -0,0 +1,476 @@
+#!/bin/env python3
+"""
+Regression checks of the firmware in src/ against the simulated hardware.
+
+    python3 sim/checks.py           # run all checks
+    python3 sim/checks.py history   # only the checks with history in their name
+
+Like run.py this works on a copy of src/ in a temporary directory. The
+exit code is 1 if a check failed.
+"""
+import argparse
+import asyncio
+import contextlib
+import io
+import os
+import random
+import re
+import socket
+import struct
+import sys
+import traceback
+
+import run
+import environment
+import hardware
+
+
+def frame(command, payload) -> bytes:
+    data = bytearray(9)
+    data[0] = 0xFF
+    data[1] = command
+    data[2:2 + len(payload)] = payload
+    data[8] = hardware._crc8(data)
+    return bytes(data)
+
+
+def reading(ppm) -> bytes:
+    return frame(0x86, bytes((ppm >> 8, ppm & 0xFF, 62, 0)))
+
+
+def decode(decoder, data) -> list:
+    # ppm of every frame the decoder accepts
+    return [decoder.frame[2] << 8 | decoder.frame[3] for byte in data if decoder.feed(byte)]
+
+
+def check_decoder_resync():
+    import mhz19
+    decoder = mhz19.FrameDecoder(mhz19.crc8, mhz19.REPLY_COMMANDS)
+    corrupted = bytearray(reading(900))
+    corrupted[5] ^= 0x10
+    dropped = reading(901)[:4] + reading(901)[5:]
+    # the header of the next frame hides inside the rejected ones
+    data = b"\x00\xff\x12" + reading(800) + corrupted + reading(801) + dropped + reading(802) + b"\xff\xff" + reading(803)
+    assert decode(decoder, data) == [800, 801, 802, 803]
+    assert decoder.crc_errors >= 2
+
+
+def check_decoder_random_damage():
+    import mhz19
+    decoder = mhz19.FrameDecoder(mhz19.crc8, mhz19.REPLY_COMMANDS)
+    generator = random.Random(17)
+    data = bytearray()
+    expected = []
+    for index in range(2000):
+        ppm = 400 + index % 1000
+        damaged = bytearray(reading(ppm))
+        damage = generator.random()
+        if damage < 0.1:
+            damaged[generator.randrange(2, 9)] ^= 1 << generator.randrange(8)
+        elif damage < 0.2:
+            del damaged[generator.randrange(9)]
+        else:
+            expected.append(ppm)
+        data += damaged
+    assert decode(decoder, data) == expected
+
+
+def check_history_rotation_and_recovery():
+    from historylog import HistoryLog
+    log = HistoryLog("checks-rotation", segments=3, segment_records=8, batch_size=2)
+    for index in range(31):
+        log.append(index, 20, 1000 + index * 60)
+    # 30 records flushed fill segments 1 to 3 and 6 records of segment 4, which replaced segment 1
+    assert len(log) == 2 * 8 + 6 + 1
+    assert log.total == 31
+    assert [record[1] for record in log] == list(range(8, 31))
+    recovered = HistoryLog("checks-rotation", segments=3, segment_records=8, batch_size=2)
+    # the record still waiting for its batch is lost, like on a power cut
+    assert (recovered.active, recovered.position, recovered.total) == (log.active, log.position, 30)
+    assert [record[1] for record in recovered] == list(range(8, 30))
+    assert [record[0] for record in recovered.records(2)] == [1000 + 28 * 60, 1000 + 29 * 60]
+    other_layout = HistoryLog("checks-rotation", segments=3, segment_records=16, batch_size=2)
+    assert len(other_layout) == 0 and other_layout.total == 0
+
+
+def check_history_since():
+    import json
+    from historylog import HistoryLog
+    from ringbuffer import BINARY_HEADER
+    log = HistoryLog("checks-since", segments=3, segment_records=8, batch_size=4)
+    for index in range(28):
+        log.append(500 + index, 20, 1000 + index * 60)
+    total = log.total
+    assert total == 28
+    values = lambda since: json.loads("".join(log.iter_json(since=since)))
+    assert values(None) == list(range(508, 528)) # the first segment was reused
+    assert values(total - 3) == [525, 526, 527]
+    assert values(total) == []
+    assert values(total - 100) == values(None) # too old, or from before a reboot
+    assert values(total + 1) == values(None)
+    binary = b"".join(bytes(chunk) for chunk in log.iter_binary(12345, since=total - 3))
+    header_size = struct.calcsize(BINARY_HEADER)
+    _, series, interval, count, capacity, start, first = struct.unpack(BINARY_HEADER, binary[:header_size])
+    assert (series, interval, count, capacity, start, first) == (1, 1, 3, 24, 12345, 25)
+    assert list(struct.unpack("<3h", binary[header_size:])) == [525, 526, 527]
+    log.flush()
+    # the numbering continues after a reboot, so cursors stay valid
+    recovered = HistoryLog("checks-since", segments=3, segment_records=8, batch_size=4)
+    assert recovered.total == total
+    assert json.loads("".join(recovered.iter_json(since=total - 2))) == [526, 527]
+
+
+def check_history_ram_tiers():
+    import json
+    from ringbuffer import AggregateRingBuffer, TieredHistory, BINARY_HEADER
+    tier = AggregateRingBuffer(3, 4)
+    # -1 is a missing reading, a bucket of only missing readings stays missing
+    for value in (400, 600, -1, 500, -1, -1, -1, -1, 700, 710, 720, 730, 1, 2):
+        tier.append(value)
+    assert (list(tier.min), list(tier.mean), list(tier.max)) == ([400, -1, 700], [500, -1, 715], [600, -1, 730])
+    assert len(tier) == 3 and tier.total == 3 # the open bucket is not counted yet
+    tier.append(3)
+    tier.append(4)
+    assert (list(tier.min), list(tier.mean), list(tier.max)) == ([-1, 700, 1], [-1, 715, 2], [-1, 730, 4])
+    total = tier.total
+    assert total == 4 and tier.count_since(total - 1) == 1 and tier.count_since(total) == 0
+    assert tier.count_since(total - 4) == 3 and tier.count_since(total + 1) == 3 # unknown cursor, all
+    assert json.loads("".join(tier.iter_json(since=total - 1))) == {"interval": 4, "min": [1], "mean": [2], "max": [4]}
+    chunks = list(tier.iter_binary(777, since=total - 2))
+    assert all(isinstance(chunk, bytes) for chunk in chunks) # len() of the chunks has to count bytes
+    binary = b"".join(chunks)
+    header_size = struct.calcsize(BINARY_HEADER)
+    _, series, interval, count, capacity, start, first = struct.unpack(BINARY_HEADER, binary[:header_size])
+    assert (series, interval, count, capacity, start, first) == (3, 4, 2, 3, 777, 2)
+    assert list(struct.unpack("<6h", binary[header_size:])) == [700, 1, 715, 2, 730, 4]
+    history = TieredHistory(minutes=30, ten_minutes=5, hours=2)
+    for minute in range(75):
+        history.append(minute)
+    assert list(history.minutes) == list(range(45, 75))
+    assert list(history.get(10).mean) == [24, 34, 44, 54, 64]
+    assert list(history.get(60).min) == [0] and history.get(60).total == 1
+    assert history.get(5) is None
+
+
+class Writer:
+    def __init__(self) -> None:
+        self.data = bytearray()
+
+    async def awrite(self, data):
+        self.data += data
+
+
+class Request:
+    def __init__(self, headers, data=b"") -> None:
+        self.headers = headers
+        reader = asyncio.StreamReader()
+        reader.feed_data(data)
+        reader.feed_eof()
+        self.sock = (reader, Writer())
+
+
+def client_frame(opcode, payload=b"", fin=True, masked=True, length=None) -> bytes:
+    mask = b"\x01\x02\x03\x04"
+    length = len(payload) if length is None else length
+    header = bytes(((0x80 if fin else 0) | opcode,))
+    if length < 126:
+        header += bytes(((0x80 if masked else 0) | length,))
+    else:
+        header += bytes(((0x80 if masked else 0) | 126,)) + struct.pack("!H", length)
+    if not masked:
+        return header + payload
+    return header + mask + bytes(byte ^ mask[index & 3] for index, byte in enumerate(payload))
+
+
+def server_frames(data) -> list:
+    # (opcode, payload) of the unmasked frames the server wrote
+    frames = []
+    while data:
+        length = data[1] & 0x7F
+        offset = 2
+        if length == 126:
+            length = struct.unpack("!H", data[2:4])[0]
+            offset = 4
+        elif length == 127:
+            length = struct.unpack("!Q", data[2:10])[0]
+            offset = 10
+        frames.append((data[0] & 0x0F, bytes(data[offset:offset + length])))
+        data = data[offset + length:]
+    return frames
+
+
+async def session(data, max_message=1024):
+    # messages the server received until the connection ended, and what it wrote after the handshake
+    import websocket
+    request = Request({"Upgrade": "websocket", "Sec-WebSocket-Key": "dGhlIHNhbXBsZSBub25jZQ=="}, data)
+    ws = await websocket.accept(request, max_message)
+    writer = request.sock[1]
+    handshake, _, writer.data = bytes(writer.data).partition(b"\r\n\r\n")
+    assert b"Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in handshake # RFC 6455 example key
+    messages = []
+    while True:
+        message = await ws.receive()
+        if message is None:
+            return messages, server_frames(bytes(writer.data))
+        messages.append(message)
+
+
+async def check_websocket_framing():
+    import websocket
+    assert await websocket.accept(Request({})) is None
+    messages, frames = await session(
+        client_frame(websocket.TEXT, b'{"command": "sensor_info"}')
+        + client_frame(websocket.BINARY, b"\x00\xff")
+        + client_frame(websocket.TEXT, b"frag", fin=False)
+        + client_frame(websocket.PING, b"alive")
+        + client_frame(websocket.CONTINUATION, b"mented")
+        + client_frame(websocket.TEXT, b"x" * 300)
+        + client_frame(websocket.CLOSE, struct.pack("!H", websocket.CLOSE_GOING_AWAY)))
+    assert messages == ['{"command": "sensor_info"}', b"\x00\xff", "fragmented", "x" * 300]
+    assert frames == [(websocket.PONG, b"alive"), (websocket.CLOSE, struct.pack("!H", websocket.CLOSE_GOING_AWAY))]
+    for data, code in (
+        (client_frame(websocket.TEXT, b"plain", masked=False), websocket.CLOSE_PROTOCOL_ERROR),
+        (client_frame(websocket.CONTINUATION, b"lost"), websocket.CLOSE_PROTOCOL_ERROR),
+        (client_frame(websocket.TEXT, b"open", fin=False) + client_frame(websocket.BINARY, b"new"), websocket.CLOSE_PROTOCOL_ERROR),
+        (client_frame(websocket.TEXT, b"\xc3\x28"), websocket.CLOSE_INVALID_DATA),
+        (client_frame(websocket.TEXT, b"x" * 200), websocket.CLOSE_TOO_BIG),
+        (client_frame(websocket.TEXT, b"x" * 100, fin=False) + client_frame(websocket.CONTINUATION, b"x" * 100), websocket.CLOSE_TOO_BIG),
+    ):
+        messages, frames = await session(data, max_message=128)
+        assert messages == [] and frames == [(websocket.CLOSE, struct.pack("!H", code))]
+    messages, frames = await session(client_frame(websocket.TEXT, b"cut off")[:5])
+    assert messages == [] and frames == []
+    writer = Writer()
+    ws = websocket.WebSocket(None, writer)
+    for length in (125, 126, 70000):
+        await ws.send(b"y" * length, binary=True)
+    await ws.send("text")
+    assert [(opcode, len(payload)) for opcode, payload in server_frames(bytes(writer.data))] == [
+        (websocket.BINARY, 125), (websocket.BINARY, 126), (websocket.BINARY, 70000), (websocket.TEXT, 4)]
+
+
+def application():
+    app = run.build(argparse.Namespace(no_webserver=True, port=0))
+    app.ap = hardware.WLAN(1) # created by run() only with the web server
+    app.display_job = app.scheduler.every(500, app.handle_display, name="display") # as in run(), the scheduler itself does not run
+    return app
+
+
+async def check_button_menu():
+    app = application()
+    matrix = app.matrix
+    task = asyncio.ensure_future(app.handle_button())
+    try:
+        # a short press toggles the access point, the release has to end the menu wait before 2 s
+        await matrix.press(200)
+        await asyncio.sleep(0.1)
+        assert app.ap.active() and app.display.state == "wifi_on"
+        await asyncio.sleep(2.2)
+        assert app.display.state == "display"
+        # a long press opens the settings, each short press moves to the next one
+        await matrix.press(2300)
+        assert app.display.state == "setting_cali"
+        await asyncio.sleep(1.1)
+        await matrix.press(200)
+        await asyncio.sleep(0.1)
+        assert app.display.state == "setting_on"
+        assert app.ap.active()
+        assert not task.done(), task.exception()
+    finally:
+        task.cancel()
+
+
+@contextlib.asynccontextmanager
+async def serving():
+    # the application with its web server on a free port, the sensor warmup is skipped
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    app = run.build(argparse.Namespace(no_webserver=False, port=port))
+    app.warmuped = True
+    task = asyncio.ensure_future(app.run())
+    try:
+        for _ in range(100):
+            try:
+                _, writer = await asyncio.open_connection("127.0.0.1", port)
+                writer.close()
+                break
+            except OSError:
+                await asyncio.sleep(0.1)
+        yield app, port
+    finally:
+        task.cancel()
+
+
+async def request(port, path):
+    # (reader, writer, status line and headers) of a GET, the body is left in reader
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(b"GET %s HTTP/1.0\r\n\r\n" % path.encode())
+    head = await reader.readuntil(b"\r\n\r\n")
+    return reader, writer, head
+
+
+class StalledWriter:
+    # a client that takes the first write and then never again
+    def __init__(self) -> None:
+        self.writes = 0
+        self.cancelled = False
+
+    async def awrite(self, data):
+        self.writes += 1
+        if self.writes > 1:
+            try:
+                await asyncio.Event().wait()
+            except asyncio.CancelledError:
+                self.cancelled = True
+                raise
+
+
+async def check_event_broadcaster():
+    from events import EventBroadcaster
+    events = EventBroadcaster(max_subscribers=2, stall_ms=200)
+    # one slot per subscriber, a message not taken yet is replaced and counted as skipped
+    subscriber = events.subscribe("first")
+    events.publish("second")
+    events.publish("third")
+    assert events.skipped == 2 and events.published == 2
+    assert await subscriber.__anext__() == b"third"
+    events.publish("fourth")
+    assert events.skipped == 2
+    assert await subscriber.__anext__() == b"fourth"
+    other = events.subscribe()
+    assert events.subscribe() is None and len(events) == 2
+    events.remove(other)
+    events.remove(subscriber)
+    assert len(events) == 0
+    # a stalled client is dropped on a later publish, its task cancelled out of the hanging write
+    writer = StalledWriter()
+    async def handler():
+        await events.stream(events.subscribe("hello"), writer)
+        return "returned"
+    task = asyncio.ensure_future(handler())
+    await asyncio.sleep(0.05) # writing hello hangs
+    events.publish("pending")
+    await asyncio.sleep(0.05)
+    events.publish("replaced")
+    await asyncio.sleep(0.25)
+    assert len(events) == 1
+    events.publish("after the stall")
+    await asyncio.wait([task], timeout=1) # unlike wait_for() it does not cancel the task itself
+    assert task.done() and task.result() == "returned"
+    assert writer.cancelled and events.dropped == 1 and len(events) == 0
+
+
+async def check_events_route_limit():
+    async with serving() as (app, port):
+        streams = []
+        for _ in range(app.events.max_subscribers):
+            reader, writer, head = await request(port, "/events")
+            assert head.startswith(b"HTTP/1.0 200") and b"text/event-stream" in head
+            assert (await reader.readuntil(b"\n\n")).startswith(b"retry:")
+            assert (await reader.readuntil(b"\n\n")).startswith(b"data: {")
+            streams.append(writer)
+        _, writer, head = await request(port, "/events")
+        assert head.startswith(b"HTTP/1.0 503") and b"Retry-After: 10" in head
+        writer.close()
+        for writer in streams:
+            writer.close()
+
+
+def parse_metrics(text) -> dict:
+    """
+    Validates the Prometheus text format, returns {family: (type, help lines,
+    [(name, labels, value)])}. Every family has one HELP and TYPE before its
+    samples and the samples of a family are not interleaved with others.
+    """
+    families = {}
+    current = None
+    for line in text.splitlines():
+        if line.startswith("# HELP "):
+            name = line.split(" ")[2]
+            assert name not in families, "second HELP for " + name
+            families[name] = [None, line, []]
+            current = name
+        elif line.startswith("# TYPE "):
+            _, _, name, kind = line.split(" ")
+            assert name == current and families[name][0] is None, "TYPE without its HELP: " + line
+            families[name][0] = kind
+        else:
+            match = re.fullmatch(r'([a-zA-Z_:][a-zA-Z0-9_:]*)(?:\{([^}]*)\})? (-?[0-9.]+|\+Inf)', line)
+            assert match, "malformed sample: " + line
+            name, labels, value = match.groups()
+            family = current
+            if families[current][0] == "histogram":
+                assert re.fullmatch(re.escape(current) + "_(bucket|sum|count)", name), "interleaved sample: " + line
+            else:
+                assert name == current, "interleaved sample: " + line
+            if name.endswith("_sum"):
+                assert re.fullmatch(r"[0-9]+\.[0-9]{6}", value), "sum format: " + line
+            families[family][2].append((name, labels or "", float(value)))
+    return families
+
+
+async def check_metrics_format():
+    from metrics import PrometheusWriter
+    async with serving() as (app, port):
+        for path in ("/json", "/missing", "/history"):
+            reader, writer, head = await request(port, path)
+            await reader.read()
+            writer.close()
+        reader, writer, head = await request(port, "/metrics")
+        text = (await reader.read()).decode()
+        writer.close()
+    assert head.startswith(b"HTTP/1.0 200")
+    families = parse_metrics(text)
+    histograms = [name for name, (kind, _, _) in families.items() if kind == "histogram"]
+    assert len(histograms) == 4
+    for name in histograms:
+        samples = families[name][2]
+        for labels in {labels.rpartition(",le=")[0] for sample, labels, _ in samples if sample.endswith("_bucket")}:
+            buckets = [value for sample, bucket_labels, value in samples if sample.endswith("_bucket") and bucket_labels.rpartition(",le=")[0] == labels]
+            assert buckets == sorted(buckets), "buckets not cumulative: " + name
+            count = [value for sample, count_labels, value in samples if sample == name + "_count" and count_labels == labels]
+            assert count == [buckets[-1]], "+Inf bucket is not the count: " + name
+        assert families[name.replace("_seconds", "_max_seconds")][0] == "gauge"
+    requests = {labels: value for _, labels, value in families["co2_http_requests_total"][2]}
+    assert requests['code="404"'] == 1 and requests['code="200"'] >= 2
+    # every write of the writer has to fit the room left above FLUSH_AT: HELP, TYPE and the longest sample
+    margin = len(PrometheusWriter().buffer) - PrometheusWriter.FLUSH_AT
+    lines = text.splitlines(keepends=True)
+    for name, (kind, help, samples) in families.items():
+        longest = max(len(line.encode()) for line in lines if line.startswith(name))
+        assert len(help) + len(name) + len(kind) + 10 + longest < margin, "entry too long for the buffer margin: " + name
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("filter", nargs="?", default="")
+    args = parser.parse_args()
+
+    os.chdir(run.flash_copy())
+    sys.path.insert(0, os.getcwd())
+
+    failed = 0
+    for name, check in list(globals().items()):
+        if not name.startswith("check_") or args.filter not in name:
+            continue
+        # fresh devices, every check runs its own event loop
+        environment.install(sensor=hardware.MHZ19Simulator(co2=hardware.constant(600)), imu=hardware.MPU6886Simulator())
+        output = io.StringIO() # what the firmware prints, only shown for a failed check
+        try:
+            with contextlib.redirect_stdout(output):
+                if asyncio.iscoroutinefunction(check):
+                    asyncio.run(check())
+                else:
+                    check()
+            print("ok    ", name[6:])
+        except Exception:
+            failed += 1
+            print("FAILED", name[6:])
+            print(output.getvalue(), end="")
+            traceback.print_exc()
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
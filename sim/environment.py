@@ -0,0 +1,119 @@
+"""
+Installs the MicroPython modules the firmware imports (machine, network,
+atom, neopixel, micropython, uasyncio, u* aliases) backed by the simulated
+hardware, and adds the MicroPython only functions of time and gc.
+Call install() before importing anything from src/.
+"""
+import asyncio
+import binascii
+import gc
+import hashlib
+import io
+import os
+import struct
+import sys
+import time
+import tracemalloc
+import types
+
+import hardware
+
+_TICKS_PERIOD = 1 << 30
+_TICKS_HALF = _TICKS_PERIOD // 2
+_HEAP_SIZE = 110 * 1024 # about what the ESP32 port has free after boot
+_START = time.monotonic_ns()
+
+
+def ticks_ms() -> int:
+    return ((time.monotonic_ns() - _START) // 1000000) & (_TICKS_PERIOD - 1)
+
+
+def ticks_us() -> int:
+    return ((time.monotonic_ns() - _START) // 1000) & (_TICKS_PERIOD - 1)
+
+
+def ticks_add(ticks, delta) -> int:
+    return (ticks + delta) & (_TICKS_PERIOD - 1)
+
+
+def ticks_diff(ticks1, ticks2) -> int:
+    return ((ticks1 - ticks2 + _TICKS_HALF) & (_TICKS_PERIOD - 1)) - _TICKS_HALF
+
+
+def mem_alloc() -> int:
+    # only meaningful while tracemalloc is tracing, see install(trace_memory=True)
+    return tracemalloc.get_traced_memory()[0] if tracemalloc.is_tracing() else 0
+
+
+def mem_free() -> int:
+    return max(_HEAP_SIZE - mem_alloc(), 0)
+
+
+_threshold = -1
+
+
+def threshold(amount=None):
+    global _threshold
+    if amount is None:
+        return _threshold
+    _threshold = amount
+
+
+class ThreadSafeFlag:
+    def __init__(self):
+        self._event = asyncio.Event()
+
+    def set(self):
+        self._event.set()
+
+    def clear(self):
+        self._event.clear()
+
+    async def wait(self):
+        await self._event.wait()
+        self._event.clear()
+
+
+def _module(name, **attributes):
+    module = types.ModuleType(name)
+    module.__dict__.update(attributes)
+    sys.modules[name] = module
+    return module
+
+
+def install(sensor=None, imu=None, trace_memory=False):
+    """
+    sensor: MHZ19Simulator on UART 2, imu: MPU6886Simulator on the I2C bus.
+    trace_memory makes gc.mem_alloc() report the traced Python heap.
+    """
+    hardware.UART.devices[2] = sensor or hardware.MHZ19Simulator()
+    hardware.I2C.devices[hardware.MPU6886Simulator.ADDRESS] = imu or hardware.MPU6886Simulator()
+
+    for name, function in (("ticks_ms", ticks_ms), ("ticks_us", ticks_us), ("ticks_add", ticks_add), ("ticks_diff", ticks_diff)):
+        setattr(time, name, function)
+    time.sleep_ms = lambda ms: time.sleep(ms / 1000)
+    time.sleep_us = lambda us: time.sleep(us / 1000000)
+    gc.mem_alloc = mem_alloc
+    gc.mem_free = mem_free
+    gc.threshold = threshold
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    _module("machine", UART=hardware.UART, Pin=hardware.Pin, I2C=hardware.I2C, SoftI2C=hardware.I2C,
+            unique_id=lambda: b"\x24\x0a\xc4\x00\x00\x01")
+    _module("network", WLAN=hardware.WLAN, AP_IF=1, STA_IF=0, AUTH_WPA_WPA2_PSK=4)
+    _module("neopixel", NeoPixel=hardware.NeoPixel)
+    _module("atom", Matrix=hardware.Matrix)
+    # no viper attribute, mhz19 falls back to its pure Python checksum
+    _module("micropython", const=lambda value: value)
+    uasyncio = _module("uasyncio", **{name: getattr(asyncio, name) for name in dir(asyncio) if not name.startswith("_")})
+    uasyncio.ThreadSafeFlag = ThreadSafeFlag
+    uasyncio.StreamReader = hardware.StreamReader
+    uasyncio.StreamWriter = hardware.StreamReader
+    uasyncio.sleep_ms = lambda ms: asyncio.sleep(ms / 1000)
+    sys.modules["ustruct"] = struct
+    sys.modules["utime"] = time
+    sys.modules["ubinascii"] = binascii
+    sys.modules["uhashlib"] = hashlib
+    sys.modules["uio"] = io
+    sys.modules["uos"] = os
@@ -0,0 +1,320 @@
+"""
+Simulated peripherals of the M5 Stack Atom Matrix with a MH-Z19 sensor.
+
+Everything here runs under CPython asyncio and mirrors only the parts of
+the MicroPython APIs the firmware in src/ uses.
+"""
+import asyncio
+import math
+import random
+import time
+
+
+def _crc8(frame) -> int:
+    return (~sum(frame[1:8]) + 1) & 0xFF
+
+
+def constant(ppm):
+    """CO2 curve with a fixed value."""
+    return lambda seconds: ppm
+
+
+def office(base=450, peak=1600, period_s=600):
+    """CO2 curve slowly rising and falling between base and peak."""
+    def curve(seconds):
+        return int(base + (peak - base) * (1 - math.cos(2 * math.pi * seconds / period_s)) / 2)
+    return curve
+
+
+class MHZ19Simulator:
+    """
+    Speaks the MH-Z19 UART protocol. Replies arrive after latency_ms, can
+    be corrupted (one bit flipped) with corrupt_rate and lose single bytes
+    with drop_rate. During the first warmup_s seconds the sensor reports
+    500 ppm like the real one.
+    """
+
+    def __init__(self, co2=None, temp=22, latency_ms=20, corrupt_rate=0.0, drop_rate=0.0, warmup_s=0.0, seed=None):
+        self.co2 = co2 or office()
+        self.temp = temp
+        self.latency_ms = latency_ms
+        self.corrupt_rate = corrupt_rate
+        self.drop_rate = drop_rate
+        self.warmup_s = warmup_s
+        self.abc = True
+        self.range = 5000
+        self.offset = 0
+        self.firmware = b"0443"
+        self.random = random.Random(seed)
+        self.started = time.monotonic()
+        self.requests = 0
+        self.corrupted = 0
+        self.dropped = 0
+        self._pending = [] # (due, bytes)
+        self._rx = bytearray()
+        self._event = None
+
+    def ppm(self, unlimited=False) -> int:
+        seconds = time.monotonic() - self.started
+        if seconds < self.warmup_s:
+            return 500
+        ppm = max(self.co2(seconds) + self.offset, 0)
+        return ppm if unlimited else min(ppm, self.range)
+
+    def _reply(self, command, payload):
+        frame = bytearray(9)
+        frame[0] = 0xFF
+        frame[1] = command
+        frame[2:2 + len(payload)] = payload
+        frame[8] = _crc8(frame)
+        if self.random.random() < self.corrupt_rate:
+            self.corrupted += 1
+            frame[self.random.randrange(2, 9)] ^= 1 << self.random.randrange(8)
+        if self.random.random() < self.drop_rate:
+            self.dropped += 1
+            del frame[self.random.randrange(9)]
+        self._pending.append((time.monotonic() + self.latency_ms / 1000, bytes(frame)))
+        if self._event is not None:
+            self._event.set()
+
+    def handle(self, frame):
+        if len(frame) != 9 or frame[0] != 0xFF or frame[1] != 0x01 or _crc8(frame) != frame[8]:
+            return
+        self.requests += 1
+        command = frame[2]
+        if command == 0x86:
+            ppm = self.ppm()
+            self._reply(0x86, bytes((ppm >> 8, ppm & 0xFF, self.temp + 40, 0)))
+        elif command == 0x85:
+            ppm = self.ppm(unlimited=True)
+            self._reply(0x85, bytes((0, 0, ppm >> 8, ppm & 0xFF)))
+        elif command == 0x7D:
+            self._reply(0x7D, bytes((0, 0, 0, 0, 0, 1 if self.abc else 0)))
+        elif command == 0xA0:
+            self._reply(0xA0, self.firmware)
+        elif command == 0x79:
+            self.abc = frame[3] == 0xA0
+        elif command == 0x87:
+            self.offset += 400 - self.ppm()
+        elif command == 0x99:
+            self.range = frame[6] << 8 | frame[7]
+
+    # receive side, used by the UART
+    def _collect(self):
+        now = time.monotonic()
+        while self._pending and self._pending[0][0] <= now:
+            self._rx += self._pending.pop(0)[1]
+
+    def available(self) -> int:
+        self._collect()
+        return len(self._rx)
+
+    def take(self, n) -> bytes:
+        self._collect()
+        data = bytes(self._rx[:n])
+        del self._rx[:n]
+        return data
+
+    async def wait_readable(self):
+        while not self.available():
+            if self._pending:
+                await asyncio.sleep(max(self._pending[0][0] - time.monotonic(), 0))
+            else:
+                if self._event is None:
+                    self._event = asyncio.Event()
+                self._event.clear()
+                await self._event.wait()
+
+
+class UART:
+    """machine.UART connected to the simulated sensor of its bus number."""
+    devices = {}
+
+    def __init__(self, id, baudrate=9600, **kwargs):
+        if id not in self.devices:
+            self.devices[id] = MHZ19Simulator()
+        self.device = self.devices[id]
+
+    def init(self, *args, **kwargs):
+        pass
+
+    def deinit(self):
+        pass
+
+    def any(self) -> int:
+        return self.device.available()
+
+    def read(self, n=-1):
+        data = self.device.take(n if n >= 0 else self.device.available())
+        return data or None
+
+    def readinto(self, buf, n=-1):
+        data = self.device.take(len(buf) if n < 0 else n)
+        if not data:
+            return None
+        buf[:len(data)] = data
+        return len(data)
+
+    def write(self, data) -> int:
+        self.device.handle(bytes(data))
+        return len(data)
+
+
+class StreamReader:
+    """uasyncio.StreamReader on top of a simulated UART."""
+
+    def __init__(self, uart, extra=None):
+        self.uart = uart
+
+    async def read(self, n=-1):
+        await self.uart.device.wait_readable()
+        return self.uart.read(n)
+
+    async def readinto(self, buf):
+        await self.uart.device.wait_readable()
+        return self.uart.readinto(buf)
+
+    async def readexactly(self, n):
+        data = b""
+        while len(data) < n:
+            data += await self.read(n - len(data))
+        return data
+
+    def write(self, data):
+        self.uart.write(data)
+
+    async def drain(self):
+        pass
+
+
+class Pin:
+    IN = 1
+    OUT = 3
+    PULL_UP = 1
+    IRQ_FALLING = 2
+    IRQ_RISING = 1
+
+    def __init__(self, id, mode=-1, pull=-1, value=1):
+        self.id = id
+        self._value = value
+        self._handler = None
+        self._trigger = 0
+
+    def value(self, value=None):
+        if value is None:
+            return self._value
+        edge = Pin.IRQ_FALLING if value < self._value else Pin.IRQ_RISING if value > self._value else 0
+        self._value = value
+        if edge & self._trigger and self._handler is not None:
+            self._handler(self)
+
+    def irq(self, handler=None, trigger=IRQ_FALLING | IRQ_RISING):
+        self._handler = handler
+        self._trigger = trigger
+
+
+class NeoPixel:
+    def __init__(self, pin, n, bpp=3):
+        self.pin = pin
+        self.n = n
+        self.pixels = [(0, 0, 0)] * n
+        self.shown = list(self.pixels)
+        self.writes = 0
+
+    def __len__(self):
+        return self.n
+
+    def __setitem__(self, index, color):
+        self.pixels[index] = tuple(color)
+
+    def __getitem__(self, index):
+        return self.pixels[index]
+
+    def fill(self, color):
+        self.pixels = [tuple(color)] * self.n
+
+    def write(self):
+        self.shown = list(self.pixels)
+        self.writes += 1
+
+
+class Matrix:
+    """atom.Matrix with the 5x5 NeoPixel matrix and the button on G39."""
+
+    def __init__(self):
+        self._np = NeoPixel(Pin(27), 25)
+        self._btn = Pin(39, Pin.IN)
+
+    def get_button_status(self):
+        return self._btn.value()
+
+    def set_button_callback(self, cb):
+        # like the frozen atom.py of the M5STACK_ATOM firmware, press only
+        self._btn.irq(handler=cb, trigger=Pin.IRQ_FALLING)
+
+    async def press(self, duration_ms=200):
+        """Simulates pressing the button for duration_ms."""
+        self._btn.value(0)
+        await asyncio.sleep(duration_ms / 1000)
+        self._btn.value(1)
+
+
+class MPU6886Simulator:
+    """I2C register file of a MPU6886 lying still with the given gravity vector (in g)."""
+    ADDRESS = 0x68
+
+    def __init__(self, acceleration=(0.0, 0.0, -1.0)):
+        self.registers = bytearray(128)
+        self.registers[0x75] = 0x19 # WHO_AM_I
+        self.reads = 0
+        self.set_acceleration(*acceleration)
+
+    def set_acceleration(self, x, y, z):
+        for register, value in ((0x3b, x), (0x3d, y), (0x3f, z)):
+            raw = max(min(int(value * 16384), 32767), -32768) & 0xFFFF
+            self.registers[register] = raw >> 8
+            self.registers[register + 1] = raw & 0xFF
+
+    def read(self, register, buf):
+        self.reads += 1
+        buf[:] = self.registers[register:register + len(buf)]
+
+    def write(self, register, buf):
+        if register == 0x6b and buf[0] & 0x80:
+            return # reset, keep the simulated state
+        self.registers[register:register + len(buf)] = buf
+
+
+class I2C:
+    """machine.I2C / machine.SoftI2C with the simulated MPU6886 attached."""
+    devices = {}
+
+    def __init__(self, id=-1, scl=None, sda=None, freq=400000, timeout=50000):
+        if MPU6886Simulator.ADDRESS not in self.devices:
+            self.devices[MPU6886Simulator.ADDRESS] = MPU6886Simulator()
+
+    def scan(self):
+        return list(self.devices)
+
+    def readfrom_mem_into(self, addr, memaddr, buf):
+        self.devices[addr].read(memaddr, buf)
+
+    def writeto_mem(self, addr, memaddr, buf):
+        self.devices[addr].write(memaddr, buf)
+
+
+class WLAN:
+    def __init__(self, interface):
+        self.interface = interface
+        self._active = False
+        self.settings = {}
+
+    def config(self, *args, **kwargs):
+        if args:
+            return self.settings.get(args[0])
+        self.settings.update(kwargs)
+
+    def active(self, active=None):
+        if active is None:
+            return self._active
+        self._active = bool(active)
@@ -0,0 +1,100 @@
+#!/bin/env python3
+"""
+Runs the firmware from src/ under CPython with simulated hardware.
+
+    python3 sim/run.py --port 8080                 # serve until Ctrl-C
+    python3 sim/run.py --duration 20 --corrupt-rate 0.2
+
+The src/ tree is copied into a temporary directory first, like onto the
+flash of the device, so files written at runtime (wifi_on_boot, history/,
+compiled templates) do not end up in the repository. With --duration the exit code
+is 1 if no valid reading arrived, usable as a smoke test.
+"""
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import tempfile
+
+SIM_DIR = os.path.dirname(os.path.abspath(__file__))
+SRC_DIR = os.path.join(os.path.dirname(SIM_DIR), "src")
+sys.path.insert(0, SIM_DIR)
+
+import environment
+import hardware
+
+
+def flash_copy() -> str:
+    target = tempfile.mkdtemp(prefix="co2-sim-")
+    shutil.copytree(SRC_DIR, target, dirs_exist_ok=True, ignore=shutil.ignore_patterns("__pycache__"))
+    return target
+
+
+def build(args):
+    """Creates the application like main.main() does, returns it with the simulated devices."""
+    import main
+    from display import DirectionSensor, Display
+    import mhz19
+    import atom
+
+    matrix = atom.Matrix()
+    sensor = mhz19.MHZ19(2, tx=33, rx=23)
+    direction_sensor = DirectionSensor(21, 25, hardware_i2c=True)
+    display = Display(matrix._np, sensor, direction_sensor, brightness=20)
+    application = main.Application(matrix, display, sensor, webserver=not args.no_webserver, port=args.port)
+    if application.webserver:
+        application.wifi_on_boot(True)
+    return application
+
+
+async def run(args, sensor):
+    application = build(args)
+    task = asyncio.ensure_future(application.run())
+    if not args.duration:
+        await task
+        return 0
+    try:
+        await asyncio.wait_for(asyncio.shield(task), args.duration)
+    except asyncio.TimeoutError:
+        task.cancel()
+    np = application.matrix._np
+    print("--- simulation summary ---", file=sys.stderr)
+    print(f"status: {application.current_status}", file=sys.stderr)
+    print(f"sensor requests: {sensor.requests}, corrupted: {sensor.corrupted}, dropped: {sensor.dropped}, decoder crc errors: {application.sensor.decoder.crc_errors}", file=sys.stderr)
+    print(f"neopixel writes: {np.writes}, imu reads: {hardware.I2C.devices[hardware.MPU6886Simulator.ADDRESS].reads}", file=sys.stderr)
+    print(f"history: {len(application.history.minutes)} minutes", file=sys.stderr)
+    return 0 if application.current_status.get("status") == "valueok" or "ppm" in application.current_status else 1
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--no-webserver", action="store_true")
+    parser.add_argument("--duration", type=float, default=0, help="seconds to run, 0 runs until interrupted")
+    parser.add_argument("--ppm", type=int, help="constant CO2 value instead of the office curve")
+    parser.add_argument("--latency-ms", type=int, default=20)
+    parser.add_argument("--corrupt-rate", type=float, default=0.0)
+    parser.add_argument("--drop-rate", type=float, default=0.0)
+    parser.add_argument("--warmup", type=float, default=0.0, help="seconds the sensor reports 500 ppm")
+    parser.add_argument("--face-down", action="store_true")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    sensor = hardware.MHZ19Simulator(
+        co2=hardware.constant(args.ppm) if args.ppm else hardware.office(),
+        latency_ms=args.latency_ms, corrupt_rate=args.corrupt_rate, drop_rate=args.drop_rate,
+        warmup_s=args.warmup, seed=args.seed)
+    imu = hardware.MPU6886Simulator((0.0, 0.0, 1.0) if args.face_down else (0.0, 0.0, -1.0))
+    environment.install(sensor=sensor, imu=imu)
+
+    os.chdir(flash_copy())
+    sys.path.insert(0, os.getcwd())
+    try:
+        sys.exit(asyncio.run(run(args, sensor)))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
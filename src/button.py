@@ -0,0 +1,39 @@
+import time
+import uasyncio as asyncio
+from machine import Pin
+
+
+class Button:
+    """
+    Edge driven button of the Atom Matrix, the pin IRQ sets a ThreadSafeFlag
+    so waiting for a press or release does not poll.
+    """
+
+    def __init__(self, matrix) -> None:
+        self.matrix = matrix
+        self._flag = asyncio.ThreadSafeFlag()
+        # matrix.set_button_callback() only triggers on press, releases have to wake wait_for() too
+        matrix._btn.irq(handler=self._irq, trigger=Pin.IRQ_FALLING | Pin.IRQ_RISING)
+
+    def _irq(self, pin):
+        self._flag.set()
+
+    def pressed(self) -> bool:
+        return not self.matrix.get_button_status()
+
+    async def wait_for(self, pressed:bool, timeout_ms=None) -> bool:
+        """Wait until the button is (not) pressed, returns False on timeout."""
+        if timeout_ms is not None:
+            deadline = time.ticks_add(time.ticks_ms(), timeout_ms)
+        while self.pressed() != pressed:
+            if timeout_ms is None:
+                await self._flag.wait()
+                continue
+            remaining = time.ticks_diff(deadline, time.ticks_ms())
+            if remaining <= 0:
+                return False
+            try:
+                await asyncio.wait_for(self._flag.wait(), remaining / 1000)
+            except asyncio.TimeoutError:
+                return False
+        return True
@@ -1,5 +1,4 @@
 import machine
-import math
 import time
 
 from mpu6886 import MPU6886
@@ -7,27 +6,101 @@ from mpu6886 import MPU6886
 COLOR_PPM = [ (500, (0,0,1)), (800, (0,1,0)), (1000, (1,1,0)), (1400, (1,0.5,0)), (100000, (1,0,0))]
 COLOR_PPM_HEX = [ (500, "00C0F0", "excellent"), (800, "10D653", "good"), (1000, "FFFD13", "okay"), (1400, "FF6B0F", "bad"), (100000, "FF3C13", "terrible")]
 
+# palette indices, the COLOR_PPM colors follow at PPM_PALETTE_OFFSET
+BLACK, WHITE, RED, GREEN, BLUE = range(5)
+PPM_PALETTE_OFFSET = 5
+PALETTE_COLORS = ((0,0,0), (1,1,1), (1,0,0), (0,1,0), (0,0,1)) + tuple(color for _, color in COLOR_PPM)
+
+
+def _ppm_palette_table() -> bytes:
+    # palette index for every 100 ppm step, all COLOR_PPM thresholds are multiples of 100
+    table = bytearray(101)
+    for step in range(len(table)):
+        level = 0
+        for level, (threshold, _) in enumerate(COLOR_PPM):
+            if threshold > step * 100:
+                break
+        table[step] = PPM_PALETTE_OFFSET + level
+    return bytes(table)
+
+
+PPM_PALETTE = _ppm_palette_table()
+
 class DirectionSensor:
 
-    def __init__(self, scl, sda):
-        self.i2c = machine.SoftI2C(scl=machine.Pin(scl), sda=machine.Pin(sda))
+    def __init__(self, scl, sda, interval_ms:int=200, smoothing_shift:int=1, stable_samples:int=3, hardware_i2c:bool=False, i2c_id:int=0, freq:int=400000, int_pin=None, motion_threshold_mg:int=64):
+        if hardware_i2c:
+            self.i2c = machine.I2C(i2c_id, scl=machine.Pin(scl), sda=machine.Pin(sda), freq=freq)
+        else:
+            self.i2c = machine.SoftI2C(scl=machine.Pin(scl), sda=machine.Pin(sda))
         self.sensor = MPU6886(self.i2c)
         self.direction = 0
+        self.interval_ms = interval_ms # minimal time between two accelerometer reads
+        self.smoothing_shift = smoothing_shift # the new sample has weight 1 / 2**shift in the low pass filter
+        self.stable_samples = stable_samples # samples a new direction has to persist before it is taken
+        self._last_sample = None
+        self._filtered = None
+        self._candidate = 0
+        self._candidate_count = 0
+        # with the INT pin of the MPU6886 connected, only sample after a wake on motion interrupt
+        self._pending_samples = 1
+        self.int_pin = None
+        if int_pin is not None:
+            self.sensor.configure_interrupt_pin()
+            self.sensor.enable_wake_on_motion(motion_threshold_mg)
+            self.int_pin = machine.Pin(int_pin, machine.Pin.IN)
+            self.int_pin.irq(trigger=machine.Pin.IRQ_RISING, handler=self._irq)
+
+    def _irq(self, pin):
+        # keep sampling long enough for the filter to settle and the new direction to become stable
+        self._pending_samples = self.stable_samples + 4
 
     def whoami(self):
         return self.sensor.whoami
 
-    def tick(self):
-        x, y, z = self.sensor.acceleration
+    @staticmethod
+    def _classify(x, y, z) -> int:
         if abs(z) > abs(x) and abs(z) > abs(y):
             if z < 0:
-                self.direction = 0
+                return 0
             else:
-                self.direction = -1
+                return -1
         elif abs(x) > abs(y):
-            self.direction = 1 if x > 0 else 3
+            return 1 if x > 0 else 3
         else:
-            self.direction = 0 if y > 0 else 2
+            return 0 if y > 0 else 2
+
+    def tick(self):
+        if self.int_pin is not None and self._pending_samples <= 0:
+            return
+        now = time.ticks_ms()
+        if self._last_sample is not None and time.ticks_diff(now, self._last_sample) < self.interval_ms:
+            return
+        self._last_sample = now
+        if self.int_pin is not None:
+            self._pending_samples -= 1
+        # raw integers are enough, only signs and magnitudes are compared
+        x, y, z = self.sensor.acceleration_raw
+        if self._filtered is None:
+            self._filtered = [x, y, z]
+            self.direction = self._classify(x, y, z)
+            return
+        filtered = self._filtered
+        shift = self.smoothing_shift
+        filtered[0] += (x - filtered[0]) >> shift
+        filtered[1] += (y - filtered[1]) >> shift
+        filtered[2] += (z - filtered[2]) >> shift
+        direction = self._classify(filtered[0], filtered[1], filtered[2])
+        if direction == self.direction:
+            self._candidate_count = 0
+            return
+        if direction != self._candidate:
+            self._candidate = direction
+            self._candidate_count = 0
+        self._candidate_count += 1
+        if self._candidate_count >= self.stable_samples:
+            self.direction = direction
+            self._candidate_count = 0
 
 class Display:
 
@@ -43,10 +116,31 @@ class Display:
     def __init__(self, neopixel, sensor, direction_sensor, brightness=1.0) -> None:
         self.np = neopixel
         self.state = "boot"
-        self.brightness = brightness
+        self.brightness = brightness # also builds self.palette
         self.reset_ticks()
         self.sensor = sensor
         self.direction_sensor = direction_sensor
+        self.rotations = tuple(self._rotation_table(direction) for direction in range(4))
+        # frames are rendered as rgb bytes, the neopixels are only written on changes
+        self.frame = bytearray(3 * len(neopixel))
+        self._shown = bytearray(len(self.frame))
+        self._black = bytes(len(self.frame))
+        self._dirty = True
+
+    @property
+    def brightness(self) -> float:
+        return self._brightness
+
+    @brightness.setter
+    def brightness(self, brightness:float) -> None:
+        self._brightness = brightness
+        self.palette = tuple(bytes(min(int(value * brightness), 255) for value in color) for color in PALETTE_COLORS)
+
+    def ppm_palette_index(self, ppm:int) -> int:
+        step = ppm // 100
+        if step >= len(PPM_PALETTE):
+            step = len(PPM_PALETTE) - 1
+        return PPM_PALETTE[step]
 
     def reset_ticks(self) -> None:
         self.tick_base = time.ticks_ms()
@@ -55,32 +149,60 @@ class Display:
         return time.ticks_diff(time.ticks_ms(), self.tick_base)
 
     def _set_black(self) -> None:
-        for i in range(len(self.np)):
-            self.np[i] = (0,0,0)
+        self.frame[:] = self._black
 
-    def _bn(self, color, additional_brightness=1.0):
-        return [int(value * self.brightness * max(additional_brightness, 0)) for value in color]
+    def _set(self, index, color) -> None:
+        entry = self.palette[color]
+        offset = 3 * index
+        frame = self.frame
+        frame[offset] = entry[0]
+        frame[offset + 1] = entry[1]
+        frame[offset + 2] = entry[2]
 
-    def _get_settings_color(self) -> tuple[float,float,float]:
+    def _set_dimmed(self, index, color, numerator, denominator) -> None:
+        # palette color scaled by numerator / denominator, integer only to avoid float allocations
+        if numerator < 0:
+            numerator = 0
+        entry = self.palette[color]
+        offset = 3 * index
+        frame = self.frame
+        frame[offset] = entry[0] * numerator // denominator
+        frame[offset + 1] = entry[1] * numerator // denominator
+        frame[offset + 2] = entry[2] * numerator // denominator
+
+    def _show(self) -> None:
+        if not self._dirty and self.frame == self._shown:
+            return
+        frame = self.frame
+        for i in range(len(self.np)):
+            offset = 3 * i
+            self.np[i] = (frame[offset], frame[offset + 1], frame[offset + 2])
+        self.np.write()
+        self._shown[:] = frame
+        self._dirty = False
+
+    def _get_settings_color(self) -> int:
         if self.state.endswith("on"):
-            return (0, 1, 0)
+            return GREEN
         elif self.state.endswith("off"):
-            return (1, 0, 0)
+            return RED
         elif self.state.endswith("cali"):
-            return (0, 0, 1)
-        return (0,0,0)
+            return BLUE
+        return BLACK
 
-    def _xy_to_index(self, x, y) -> int:
+    @staticmethod
+    def _xy_to_index(x, y) -> int:
         WIDTH = 5
         return x + y * WIDTH
 
-    def _index_to_xy(self, index) -> tuple[int, int]:
+    @staticmethod
+    def _index_to_xy(index) -> tuple[int, int]:
         WIDTH = 5
         return index % WIDTH, index // WIDTH
 
-    def _rotate_xy(self, x, y) -> tuple[int, int]:
+    @staticmethod
+    def _rotate_xy(x, y, direction) -> tuple[int, int]:
         WIDTH = 5
-        direction = self.direction_sensor.direction
         if direction == 1:
             x = WIDTH - 1 - x
             x, y = y, x
@@ -92,10 +214,26 @@ class Display:
             x, y = y, x
         return x, y
 
+    @classmethod
+    def _rotation_table(cls, direction) -> bytes:
+        table = bytearray(25)
+        for index in range(25):
+            x, y = cls._index_to_xy(index)
+            table[index] = cls._xy_to_index(*cls._rotate_xy(x, y, direction))
+        return bytes(table)
+
+    def _rotation(self) -> bytes:
+        # direction -1 (face down) is blanked anyway, index 0 is never used for it
+        return self.rotations[max(self.direction_sensor.direction, 0)]
+
     def _rotate_index(self, index) -> int:
-        x, y = self._index_to_xy(index)
-        x, y = self._rotate_xy(x, y)
-        return self._xy_to_index(x, y)
+        return self._rotation()[index]
+
+    def animating(self) -> bool:
+        # whether the next frames differ without a state change
+        if self.state == "warmup":
+            return True
+        return self.state == "display" and self._ticks() < 1000
 
     def set_state(self, state):
         self.state = state
@@ -104,53 +242,50 @@ class Display:
 
     def update(self):
         self.direction_sensor.tick()
+        rotation = self._rotation()
+        count = len(rotation)
         if self.state == "boot":
-            for i in range(len(self.np)):
-                color = self._bn((1, 1, 1) if i % 2 == 0 else (0,0,0))
-                self.np[self._rotate_index(i)] = color
+            for i in range(count):
+                self._set(rotation[i], WHITE if i % 2 == 0 else BLACK)
         elif self.state == "error":
-            for i in range(len(self.np)):
-                color = self._bn((1, 0, 0) if i % 2 == 0 else (0,0,1))
-                self.np[self._rotate_index(i)] = color
+            for i in range(count):
+                self._set(rotation[i], RED if i % 2 == 0 else BLUE)
         elif self.state == "warmup":
             self._set_black()
             warmup_time = 90 * 1000
-            current_progress = (len(self.np) * self._ticks() / warmup_time) % len(self.np)
-            current_index = math.floor(current_progress)
+            current_progress = (count * self._ticks()) % (count * warmup_time)
+            current_index = current_progress // warmup_time
             for i in range(current_index):
-                self.np[self._rotate_index(i)] = self._bn((1,1,1))
-            self.np[self._rotate_index(current_index)] = self._bn((1,1,1), current_progress % 1)
+                self._set(rotation[i], WHITE)
+            self._set_dimmed(rotation[current_index], WHITE, current_progress % warmup_time, warmup_time)
         elif self.state == "display":
             self._set_black()
             if self.sensor.ppm < 0:
                 for i in range(15):
-                    color = self._bn((1,0,0) if i % 2 == 0 else (0,1,0), additional_brightness=0.2)
-                    self.np[self._rotate_index(i)] = color
+                    self._set_dimmed(rotation[i], RED if i % 2 == 0 else GREEN, 1, 5)
             else:
-                color = (0,0,0)
-                for threshold, color_of_threshold in COLOR_PPM:
-                    color = color_of_threshold
-                    if threshold > self.sensor.ppm:
-                        break
+                color = self.ppm_palette_index(self.sensor.ppm)
                 for i in range(15):
-                    self.np[self._rotate_index(i)] = self._bn(color)
+                    self._set(rotation[i], color)
 
-                if self._ticks() < 1000:
-                    self.np[self._rotate_index(19)] = self._bn(color, additional_brightness=(1 - (self._ticks()/1000))*0.5)
+                ticks = self._ticks()
+                if ticks < 1000:
+                    self._set_dimmed(rotation[19], color, 1000 - ticks, 2000)
 
-                hundrest_ppm = math.floor(self.sensor.ppm / 100)
-                color = (1,1,1)
+                hundrest_ppm = self.sensor.ppm // 100
                 for i in range(5):
-                    self.np[self._rotate_index(24 - i)] = self._bn(color if hundrest_ppm & 2**i > 0 else (0,0,0))
+                    self._set(rotation[24 - i], WHITE if hundrest_ppm & (1 << i) else BLACK)
         elif self.state.startswith("setting_"):
             self._set_black()
-            self.np[self._rotate_index(0)] = self._bn(self._get_settings_color())
+            self._set(rotation[0], self._get_settings_color())
         elif self.state.startswith("applied_"):
-            for i in range(len(self.np)):
-                self.np[self._rotate_index(i)] = self._bn(self._get_settings_color())
+            color = self._get_settings_color()
+            for i in range(count):
+                self._set(rotation[i], color)
         elif self.state.startswith("wifi_"):
-            for i in range(len(self.np)):
-                self.np[self._rotate_index(i)] = self._bn(self._get_settings_color()) if self.WIFI_SYMBOL[i] else (0,0,0)
+            color = self._get_settings_color()
+            for i in range(count):
+                self._set(rotation[i], color if self.WIFI_SYMBOL[i] else BLACK)
         if self.direction_sensor.direction == -1:
             self._set_black()
-        self.np.write()
+        self._show()
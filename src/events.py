@@ -0,0 +1,131 @@
+import time
+import uasyncio as asyncio
+
+
+class Subscriber:
+    """One Server-Sent Events connection, iterating it waits for the next message."""
+
+    def __init__(self) -> None:
+        self._event = asyncio.Event()
+        self._message = None # newest message not taken yet
+        self.waiting_since = 0 # ticks_ms when the pending message was offered
+        self.closed = False
+        self.task = None # task serving the connection, cancelled if the client stalls
+
+    def offer(self, message:bytes) -> bool:
+        """Replaces a message the client did not take yet, returns True if one was skipped."""
+        skipped = self._message is not None
+        if not skipped:
+            self.waiting_since = time.ticks_ms()
+        self._message = message
+        self._event.set()
+        return skipped
+
+    def stalled(self, now:int, stall_ms:int) -> bool:
+        return self._message is not None and time.ticks_diff(now, self.waiting_since) > stall_ms
+
+    def close(self):
+        self.closed = True
+        self._event.set()
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        while self._message is None and not self.closed:
+            self._event.clear()
+            await self._event.wait()
+        if self.closed:
+            raise StopAsyncIteration
+        message = self._message
+        self._message = None
+        return message
+
+
+class EventBroadcaster:
+    """
+    Pushes messages to a bounded number of live subscribers, Server-Sent
+    Events streams and WebSockets share the slots.
+    Every subscriber holds at most one unsent message, a slow client skips
+    to the newest one instead of queueing them up. A subscriber that did not
+    take a message for stall_ms is stuck and gets dropped, its task is
+    cancelled as it may hang in a write that never returns.
+    """
+    RETRY = b"retry: 5000\n\n" # reconnect delay for the browser
+    HEADERS = b"HTTP/1.0 200 OK\r\nContent-Type: text/event-stream\r\nCache-Control: no-cache\r\n\r\n"
+
+    def __init__(self, max_subscribers:int=4, stall_ms:int=30000) -> None:
+        self.max_subscribers = max_subscribers
+        self.stall_ms = stall_ms
+        self._subscribers = []
+        self.published = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def _drop_stalled(self):
+        now = time.ticks_ms()
+        for subscriber in [subscriber for subscriber in self._subscribers if subscriber.stalled(now, self.stall_ms)]:
+            self.remove(subscriber)
+            if subscriber.task is not None:
+                subscriber.task.cancel()
+            self.dropped += 1
+
+    def subscribe(self, data:str=None):
+        """
+        Returns a new subscriber, optionally starting with data, or None if all
+        slots are taken. The calling task serves the subscriber and is the one
+        cancelled if it stalls.
+        """
+        self._drop_stalled()
+        if len(self._subscribers) >= self.max_subscribers:
+            return None
+        subscriber = Subscriber()
+        subscriber.task = asyncio.current_task()
+        self._subscribers.append(subscriber)
+        if data is not None:
+            subscriber.offer(data.encode())
+        return subscriber
+
+    def remove(self, subscriber:Subscriber):
+        subscriber.close()
+        if subscriber in self._subscribers:
+            self._subscribers.remove(subscriber)
+
+    def publish(self, data:str):
+        if not self._subscribers:
+            return
+        self._drop_stalled()
+        message = data.encode() # once for all subscribers
+        for subscriber in self._subscribers:
+            if subscriber.offer(message):
+                self.skipped += 1
+        self.published += 1
+
+    async def forward(self, subscriber:Subscriber, send):
+        """Awaits send(message) for the messages of subscriber until the client disconnects or is dropped."""
+        try:
+            async for message in subscriber:
+                await send(message)
+        except OSError:
+            pass # client disconnected
+        finally:
+            self.remove(subscriber)
+
+    async def stream(self, subscriber:Subscriber, writer):
+        """Writes the Server-Sent Events response of subscriber to a microdot_asyncio connection."""
+        async def send(message):
+            await writer.awrite(b"data: ")
+            await writer.awrite(message)
+            await writer.awrite(b"\n\n")
+        try:
+            await writer.awrite(self.HEADERS + self.RETRY)
+            await self.forward(subscriber, send)
+        except OSError:
+            pass # client disconnected
+        except asyncio.CancelledError:
+            pass # dropped as stalled, returning lets microdot close the connection
+        finally:
+            self.remove(subscriber)
@@ -0,0 +1,49 @@
+import gc
+import time
+
+
+class GCManager:
+    """
+    Collects only when the heap grew by more than growth bytes since the
+    last collection, instead of on every tick. maybe_collect() is cheap
+    enough to be called after every request or sensor cycle.
+    """
+
+    def __init__(self, growth:int=8 * 1024, auto_threshold:bool=True) -> None:
+        self.growth = growth
+        self.collections = 0
+        self.time_spent_us = 0
+        self.max_time_us = 0
+        self.peak_alloc = 0
+        if auto_threshold:
+            # let the runtime collect on its own before the heap runs full
+            gc.threshold(gc.mem_free() // 4 + gc.mem_alloc())
+        self._baseline = gc.mem_alloc()
+
+    def collect(self):
+        alloc = gc.mem_alloc()
+        if alloc > self.peak_alloc:
+            self.peak_alloc = alloc
+        start = time.ticks_us()
+        gc.collect()
+        duration = time.ticks_diff(time.ticks_us(), start)
+        self.collections += 1
+        self.time_spent_us += duration
+        if duration > self.max_time_us:
+            self.max_time_us = duration
+        self._baseline = gc.mem_alloc()
+
+    def maybe_collect(self) -> bool:
+        alloc = gc.mem_alloc()
+        if alloc > self.peak_alloc:
+            self.peak_alloc = alloc
+        if alloc < self._baseline:
+            # the runtime collected in between
+            self._baseline = alloc
+        elif alloc - self._baseline > self.growth:
+            self.collect()
+            return True
+        return False
+
+    def info(self) -> str:
+        return f"collections: {self.collections}\ntime spent: {self.time_spent_us // 1000} ms\nmax collection time: {self.max_time_us} us\npeak used: {self.peak_alloc}"
@@ -0,0 +1,250 @@
+import os
+import struct
+import time
+
+from ringbuffer import binary_header, count_since
+
+MAGIC = b"CO2H"
+HEADER = "<4sIHH" # magic, sequence, record size, records per segment
+HEADER_SIZE = struct.calcsize(HEADER)
+RECORD = "<Ihh" # timestamp (time.time(), starts over at every power-up without NTP or RTC), ppm, temperature
+RECORD_SIZE = struct.calcsize(RECORD)
+EMPTY = 0xFFFFFFFF # timestamp of an erased record
+_ERASED = b"\xff" * 256
+
+
+class HistoryLog:
+    """
+    Minute values persisted as an append-only log of fixed size records
+    spread over preallocated segment files. The active segment is filled
+    front to back, when it is full the oldest segment is erased and becomes
+    the next one, so every part of the files is written equally often.
+    Records are written in batches of batch_size to keep flash writes rare,
+    at most batch_size - 1 records are lost on a power cut.
+    Boot only reads the segment headers, plus a binary search for the end
+    of the active segment.
+    Filesystem errors are counted in errors instead of raised, the batch is
+    lost then. If the segments cannot be set up at boot, available is False
+    and appended records are dropped.
+    """
+
+    def __init__(self, directory:str="history", segments:int=4, segment_records:int=60 * 24, batch_size:int=10) -> None:
+        self.directory = directory
+        self.segments = segments
+        self.segment_records = segment_records
+        self.batch_size = batch_size
+        self._sequences = [0] * segments # 0 marks a never used segment
+        self.active = 0
+        self.position = 0 # records written to the active segment
+        self._pending = bytearray(batch_size * RECORD_SIZE)
+        self._pending_count = 0
+        self.flushes = 0
+        self.errors = 0 # failed filesystem operations
+        self.available = False
+        self.recover()
+
+    def _path(self, index:int) -> str:
+        return "%s/%d" % (self.directory, index)
+
+    def _read_header(self, index:int) -> int:
+        # sequence of a valid segment, -1 if missing or written with another layout
+        try:
+            with open(self._path(index), "rb") as segment:
+                header = segment.read(HEADER_SIZE)
+        except OSError:
+            return -1
+        if len(header) < HEADER_SIZE:
+            return -1
+        magic, sequence, record_size, segment_records = struct.unpack(HEADER, header)
+        if magic != MAGIC or record_size != RECORD_SIZE or segment_records != self.segment_records:
+            return -1
+        return sequence
+
+    def _write_header(self, segment, sequence:int):
+        segment.seek(0)
+        segment.write(struct.pack(HEADER, MAGIC, sequence, RECORD_SIZE, self.segment_records))
+
+    def _erase(self, segment):
+        segment.seek(HEADER_SIZE)
+        remaining = self.segment_records * RECORD_SIZE
+        while remaining > 0:
+            count = min(remaining, len(_ERASED))
+            segment.write(_ERASED[:count])
+            remaining -= count
+
+    def _format(self, index:int):
+        # preallocates the full segment, later writes never grow the file
+        with open(self._path(index), "wb") as segment:
+            self._erase(segment)
+            self._write_header(segment, 0)
+        self._sequences[index] = 0
+
+    def _timestamp_at(self, segment, position:int) -> int:
+        segment.seek(HEADER_SIZE + position * RECORD_SIZE)
+        return struct.unpack("<I", segment.read(4))[0]
+
+    def _find_end(self, index:int) -> int:
+        # records are written front to back, so the first erased one is the end
+        low = 0
+        high = self.segment_records
+        with open(self._path(index), "rb") as segment:
+            while low < high:
+                middle = (low + high) // 2
+                if self._timestamp_at(segment, middle) == EMPTY:
+                    high = middle
+                else:
+                    low = middle + 1
+        return low
+
+    def recover(self):
+        try:
+            os.mkdir(self.directory)
+        except OSError:
+            pass # exists
+        try:
+            self._recover()
+            self.available = True
+        except OSError as error:
+            print("history log unavailable:", repr(error))
+            self.errors += 1
+            self._sequences = [0] * self.segments
+            self.position = 0
+            self.available = False
+
+    def _recover(self):
+        for index in range(self.segments):
+            sequence = self._read_header(index)
+            if sequence < 0:
+                self._format(index)
+            else:
+                self._sequences[index] = sequence
+        self.active = 0
+        for index in range(self.segments):
+            if self._sequences[index] > self._sequences[self.active]:
+                self.active = index
+        if self._sequences[self.active] == 0:
+            # nothing written yet, start the first segment
+            with open(self._path(self.active), "r+b") as segment:
+                self._write_header(segment, 1)
+            self._sequences[self.active] = 1
+            self.position = 0
+        else:
+            self.position = self._find_end(self.active)
+
+    def _rotate(self):
+        # the erase happens before the header marks the segment as newest, a
+        # power cut in between leaves an empty oldest segment
+        index = (self.active + 1) % self.segments
+        sequence = self._sequences[self.active] + 1
+        with open(self._path(index), "r+b") as segment:
+            self._erase(segment)
+            self._write_header(segment, sequence)
+        self._sequences[index] = sequence
+        self.active = index
+        self.position = 0
+
+    def append(self, ppm:int, temp:int, timestamp=None):
+        if timestamp is None:
+            timestamp = int(time.time()) # float on some ports
+        struct.pack_into(RECORD, self._pending, self._pending_count * RECORD_SIZE, timestamp, ppm, temp)
+        self._pending_count += 1
+        if self._pending_count >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        pending = memoryview(self._pending)
+        written = 0
+        try:
+            while self.available and written < self._pending_count:
+                if self.position >= self.segment_records:
+                    self._rotate()
+                count = min(self.segment_records - self.position, self._pending_count - written)
+                with open(self._path(self.active), "r+b") as segment:
+                    segment.seek(HEADER_SIZE + self.position * RECORD_SIZE)
+                    segment.write(pending[written * RECORD_SIZE:(written + count) * RECORD_SIZE])
+                self.position += count
+                written += count
+        except OSError as error:
+            # flash full or failing, the rest of the batch is lost but the RAM history goes on
+            print("history flush failed:", repr(error))
+            self.errors += 1
+        if written:
+            self.flushes += 1
+        self._pending_count = 0
+
+    def __len__(self) -> int:
+        used = sum(1 for index in range(self.segments) if self._sequences[index] and index != self.active)
+        return used * self.segment_records + self.position + self._pending_count
+
+    @property
+    def capacity(self) -> int:
+        return self.segments * self.segment_records
+
+    @property
+    def total(self) -> int:
+        # number of the next record, keeps counting across reboots as segment sequences do
+        return (self._sequences[self.active] - 1) * self.segment_records + self.position + self._pending_count
+
+    def count_since(self, since=None) -> int:
+        return count_since(self.total, len(self), since)
+
+    def _chunks(self, chunk_records:int, count=None):
+        # the newest count records oldest to newest as views into one reused buffer, the pending records last
+        buffer = bytearray(chunk_records * RECORD_SIZE)
+        view = memoryview(buffer)
+        order = sorted((sequence, index) for index, sequence in enumerate(self._sequences) if sequence)
+        active, position, pending = self.active, self.position, self._pending_count
+        skip = 0 if count is None else max(len(self) - count, 0)
+        for _, index in order:
+            records = position if index == active else self.segment_records
+            if skip >= records:
+                skip -= records
+                continue
+            remaining = (records - skip) * RECORD_SIZE
+            with open(self._path(index), "rb") as segment:
+                segment.seek(HEADER_SIZE + skip * RECORD_SIZE)
+                skip = 0
+                while remaining > 0:
+                    length = segment.readinto(view[:min(remaining, len(buffer))])
+                    if not length:
+                        break
+                    remaining -= length
+                    yield view[:length]
+        if pending > skip:
+            yield memoryview(self._pending)[skip * RECORD_SIZE:pending * RECORD_SIZE]
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, count=None):
+        # (timestamp, ppm, temp) of the newest count records oldest first, erased records left by a power cut are skipped
+        for chunk in self._chunks(32, count):
+            for offset in range(0, len(chunk) - RECORD_SIZE + 1, RECORD_SIZE):
+                record = struct.unpack_from(RECORD, chunk, offset)
+                if record[0] != EMPTY:
+                    yield record
+
+    def iter_json(self, chunk_size:int=32, since=None):
+        # ppm values as json array, same format as RingBuffer.iter_json, erased records read as -1
+        yield "["
+        separator = ""
+        for chunk in self._chunks(chunk_size, self.count_since(since)):
+            if chunk:
+                yield separator + ",".join(str(struct.unpack_from("<h", chunk, offset)[0]) for offset in range(4, len(chunk), RECORD_SIZE))
+                separator = ","
+        yield "]"
+
+    def iter_binary(self, start:int=0, since=None, chunk_records:int=32):
+        # ppm of the records as int16 after the binary header, erased records read as -1. Like for the
+        # RAM tiers start is given by the caller, the record timestamps restart at every power-up
+        count = self.count_since(since)
+        yield binary_header(1, 1, count, self.capacity, start, self.total - count)
+        samples = bytearray(chunk_records * 2)
+        view = memoryview(samples)
+        for chunk in self._chunks(chunk_records, count):
+            length = 0
+            for offset in range(4, len(chunk), RECORD_SIZE):
+                samples[length] = chunk[offset]
+                samples[length + 1] = chunk[offset + 1]
+                length += 2
+            yield view[:length]
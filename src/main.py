@@ -13,28 +13,54 @@ import gc
 import mhz19
 
 from display import DirectionSensor, Display, COLOR_PPM_HEX
-from ringbuffer import RingBuffer
+from ringbuffer import TieredHistory
+from historylog import HistoryLog
+from scheduler import Scheduler
+from gcmanager import GCManager
+from button import Button
+from events import EventBroadcaster
+import websocket
+from metrics import Histogram, PrometheusWriter
 
 
 
 class Application:
 
-    def __init__(self, matrix, display, sensor, webserver:bool=True):
+    def __init__(self, matrix, display, sensor, webserver:bool=True, port:int=80):
         self.matrix = matrix
+        self.button = Button(matrix)
         self.display = display
         self.sensor = sensor
-        self.last_reading = time.ticks_ms()
         self.failed_readings = 0
+        self.sensor_reads = 0
+        self.sensor_failures = 0
+        self.sensor_latency = Histogram() # us per read
+        self.request_time = Histogram() # us per request, until the handler returned
+        self.requests = {} # status code -> count
+        self.boot_time = int(time.time()) # ticks_ms wraps after about 12 days, the uptime must not
         self.warmuped = False
         self.current_status = {}
+        self.events = EventBroadcaster() # live readings for the web pages
+        self.commands = { # settings actions, as GET routes and over the WebSocket
+            "calibration_on": self.calibration_on,
+            "calibration_off": self.calibration_off,
+            "calibration_now": self.calibration_now,
+            "sensor_info": self.sensor_info,
+            "wifi_on_boot_enable": self.wifi_on_boot_enable,
+            "wifi_on_boot_disable": self.wifi_on_boot_disable,
+        }
         self.webserver = webserver
-        self.ring_buffer = RingBuffer(60 * 8) # every minute for 8 hours
-        self.last_ring_buffer_append = time.ticks_ms()
+        self.port = port
+        self.history = TieredHistory() # minutes for 8 hours, 10 minutes for 3 days, hours for 30 days
+        self.history_log = HistoryLog() # minutes of the last 3 to 4 days in flash, survives a power cycle
+        self.restore_history()
         self.ap = None
+        self.scheduler = Scheduler()
+        self.gc = GCManager()
 
     async def run(self):
         if self.webserver:
-            from microdot_asyncio import Microdot, send_file
+            from microdot_asyncio import Microdot, Response, send_file
             from microdot_utemplate import render_template, init_templates
             init_templates("web")
 
@@ -62,52 +88,216 @@ class Application:
                 return send_file("web/settings.html")
             @app.route('/calibration_on')
             async def calibration_on(request):
-                self.sensor.enable_self_calibration()
-                return "Self calibration turned on"
+                return await self.calibration_on()
             @app.route('/calibration_off')
             async def calibration_off(request):
-                self.sensor.disable_self_calibration()
-                return "Self calibration turned off"
+                return await self.calibration_off()
             @app.route('/calibration_now')
             async def calibration_now(request):
-                self.sensor.zero_point_calibration()
-                return "Calibrated to zero point (400 ppm)"
+                return await self.calibration_now()
+            @app.route('/sensor_info')
+            async def sensor_info(request):
+                return await self.sensor_info()
             @app.route('/wifi_on_boot_enable')
             async def wifi_on_boot_enable(request):
-                self.wifi_on_boot(True)
-                return "Enabled wifi on boot"
+                return await self.wifi_on_boot_enable()
             @app.route('/wifi_on_boot_disable')
             async def wifi_on_boot_disable(request):
-                self.wifi_on_boot(False)
-                return "Disabled wifi on boot"
+                return await self.wifi_on_boot_disable()
+            @app.route('/ws')
+            async def websocket_route(request):
+                subscriber = self.events.subscribe(json.dumps(self.current_status))
+                if subscriber is None:
+                    return "Too many live connections", 503, {'Retry-After': '10'}
+                ws = await websocket.accept(request)
+                if ws is None:
+                    self.events.remove(subscriber)
+                    return "Expected a WebSocket upgrade", 400
+                await self.websocket_session(ws, subscriber)
+                return Response.already_handled
             @app.route('/json')
             async def json_route(request):
                 return self.current_status
+            def history_query(request):
+                # tier and since cursor of a history request, tier is None if the query is invalid
+                try:
+                    resolution = int(request.args.get("resolution", 1)) # args is a plain dict without query string
+                    since = request.args.get("since")
+                    since = None if since is None else int(since)
+                except ValueError:
+                    return None, None
+                if resolution == 1 and self.history_log.available:
+                    return self.history_log, since # streamed from flash, reaches further back than the RAM tier
+                return self.history.get(resolution), since
+            @app.route('/events')
+            async def events(request):
+                subscriber = self.events.subscribe(json.dumps(self.current_status))
+                if subscriber is None:
+                    return "Too many live connections", 503, {'Retry-After': '10'}
+                # the handler keeps the connection, microdot only closes it afterwards
+                await self.events.stream(subscriber, request.sock[1])
+                return Response.already_handled
             @app.route('/history')
             async def history(request):
-                return self.ring_buffer.get_list()
+                tier, since = history_query(request)
+                if tier is None:
+                    return "Unknown resolution (use 1, 10 or 60 minutes) or invalid since", 400
+                first = tier.total - tier.count_since(since)
+                return tier.iter_json(since=since), {'Content-Type': 'application/json', 'X-History-First': str(first)}
+            @app.route('/history.bin')
+            async def history_binary(request):
+                tier, since = history_query(request)
+                if tier is None:
+                    return "Unknown resolution (use 1, 10 or 60 minutes) or invalid since", 400
+                # estimated from the sample count, the clock starts over at every power-up
+                start = int(time.time()) - tier.count_since(since) * getattr(tier, "bucket_size", 1) * 60
+                return tier.iter_binary(max(start, 0), since), {'Content-Type': 'application/octet-stream'}
             @app.route('/meminfo')
             async def meminfo(request):
                 free = gc.mem_free()
                 alloc = gc.mem_alloc()
-                return f"{100*alloc/(free+alloc):.1f} % mem used\nused: {alloc}\nfree: {free}"
+                return f"{100*alloc/(free+alloc):.1f} % mem used\nused: {alloc}\nfree: {free}\n{self.gc.info()}"
+            @app.route('/metrics')
+            async def metrics_route(request):
+                return self.metrics(), {'Content-Type': 'text/plain; version=0.0.4'}
+            @app.before_request
+            async def start_request_timer(request):
+                request.g.start = time.ticks_us()
+            @app.after_request
+            async def collect_after_request(request, response):
+                if response is not Response.already_handled: # streams would record their lifetime
+                    self.request_time.record(time.ticks_diff(time.ticks_us(), request.g.start))
+                self.requests[response.status_code] = self.requests.get(response.status_code, 0) + 1
+                self.scheduler.schedule(self.gc_job) # runs once the response is on its way
+            @app.after_error_request
+            async def collect_after_error_request(request, response):
+                # 404, 413, 500 and the like skip after_request, request may be None and has no start time
+                self.requests[response.status_code] = self.requests.get(response.status_code, 0) + 1
 
         self.display.update()
         time.sleep(1)
+        await self.sensor.query_info()
         await self.warmup()
 
+        self.scheduler.every(2000, self.handle_sensor, name="sensor")
+        self.scheduler.every(60000, self.handle_history, delay_ms=60000, name="history")
+        self.display_job = self.scheduler.every(500, self.handle_display, name="display")
+        self.gc_job = self.scheduler.every(1000, self.handle_gc, name="gc")
+
         if self.webserver:
-            await asyncio.gather(self.handle_gc(), self.handle_button_and_display(), self.handle_sensor(), app.start_server(port=80))
+            await asyncio.gather(self.scheduler.run(), self.handle_button(), app.start_server(port=self.port))
         else:
-            await asyncio.gather(self.handle_gc(), self.handle_button_and_display(), self.handle_sensor())
+            await asyncio.gather(self.scheduler.run(), self.handle_button())
+
+
+    async def calibration_on(self) -> str:
+        self.sensor.enable_self_calibration()
+        return "Self calibration turned on" if await self.sensor.get_abc_status() else "Self calibration could not be turned on"
+
+    async def calibration_off(self) -> str:
+        self.sensor.disable_self_calibration()
+        return "Self calibration turned off" if await self.sensor.get_abc_status() is False else "Self calibration could not be turned off"
+
+    async def calibration_now(self) -> str:
+        self.sensor.zero_point_calibration()
+        return "Calibrated to zero point (400 ppm)"
 
+    async def sensor_info(self) -> dict:
+        await self.sensor.query_info()
+        return {"abc": self.sensor.abc_enabled, "firmware": self.sensor.firmware_version, "ppm_unlimited": self.sensor.ppm_unlimited}
 
-    def update_status(self, status: str, values: Optional[dict] = None):
+    async def wifi_on_boot_enable(self) -> str:
+        self.wifi_on_boot(True)
+        return "Enabled wifi on boot"
+
+    async def wifi_on_boot_disable(self) -> str:
+        self.wifi_on_boot(False)
+        return "Disabled wifi on boot"
+
+    async def websocket_session(self, ws, subscriber):
+        # live readings go down from a second task, commands come up as {"command": name}
+        async def send_readings():
+            await self.events.forward(subscriber, ws.send)
+            await ws.close(websocket.CLOSE_GOING_AWAY) # the connection failed
+        sender = asyncio.create_task(send_readings())
+        try:
+            while True:
+                message = await ws.receive()
+                if message is None:
+                    break
+                try:
+                    name = json.loads(message)["command"]
+                    command = self.commands[name]
+                except (ValueError, KeyError, TypeError):
+                    await ws.send(json.dumps({"error": "unknown command"}))
+                    continue
+                await ws.send(json.dumps({"command": name, "result": await command()}))
+        except OSError:
+            pass # client disconnected
+        except asyncio.CancelledError:
+            ws.closed = True # dropped as stalled, a close frame would hang like the readings did
+        finally:
+            self.events.remove(subscriber)
+            sender.cancel()
+            await ws.close()
+
+    def update_status(self, status: str, values: dict = None):
         if values is None:
             values = {}
         prototype_dict = {"status": status, "time": time.ticks_ms()}
         self.current_status = prototype_dict | values
-        print(json.dumps(self.current_status))
+        message = json.dumps(self.current_status)
+        print(message)
+        self.events.publish(message)
+
+    def metrics(self):
+        """Generator of the Prometheus text format, streamed as chunks of one buffer."""
+        writer = PrometheusWriter()
+        sensor = self.sensor
+        gauge = writer.gauge
+        counter = writer.counter
+        for write, name, help, value in (
+            (gauge, b"co2_ppm", b"CO2 concentration in ppm, -1 if unknown", sensor.ppm),
+            (gauge, b"co2_temperature_celsius", b"Temperature reported by the sensor", sensor.temp),
+            (gauge, b"co2_sensor_status", b"Status byte reported by the sensor", sensor.co2status),
+            (gauge, b"co2_failed_readings", b"Consecutive failed sensor readings", self.failed_readings),
+            (counter, b"co2_sensor_reads_total", b"Sensor reads", self.sensor_reads),
+            (counter, b"co2_sensor_failures_total", b"Failed sensor reads", self.sensor_failures),
+            (counter, b"co2_sensor_crc_errors_total", b"Sensor frames with a wrong checksum", sensor.decoder.crc_errors),
+            (gauge, b"co2_uptime_seconds", b"Seconds since boot", int(time.time()) - self.boot_time),
+            (gauge, b"co2_memory_used_bytes", b"Allocated heap", gc.mem_alloc()),
+            (gauge, b"co2_memory_free_bytes", b"Free heap", gc.mem_free()),
+            (gauge, b"co2_memory_peak_bytes", b"Highest heap allocation seen by the gc manager", self.gc.peak_alloc),
+            (counter, b"co2_gc_collections_total", b"Garbage collections run by the gc manager", self.gc.collections),
+            (counter, b"co2_history_flushes_total", b"Batched history writes to flash", self.history_log.flushes),
+            (counter, b"co2_history_errors_total", b"Failed history filesystem operations", self.history_log.errors),
+            (gauge, b"co2_event_subscribers", b"Open live reading streams", len(self.events)),
+            (counter, b"co2_event_skipped_total", b"Live readings replaced before a slow client took them", self.events.skipped),
+            (counter, b"co2_event_dropped_total", b"Live reading streams dropped as stalled", self.events.dropped),
+        ):
+            if write(name, help, value):
+                yield writer.flush()
+        for status_code, count in self.requests.items():
+            if writer.counter(b"co2_http_requests_total", b"HTTP requests by status code", count, b'code="%d"' % status_code):
+                yield writer.flush()
+        histograms = [ # name, help, name and help of the maximum, histogram, labels
+            (b"co2_http_request_duration_seconds", b"Time until the handler returned",
+             b"co2_http_request_duration_max_seconds", b"Longest time until the handler returned", self.request_time, b""),
+            (b"co2_sensor_read_duration_seconds", b"Sensor request until reply",
+             b"co2_sensor_read_duration_max_seconds", b"Longest sensor request until reply", self.sensor_latency, b""),
+            (b"co2_scheduler_lag_seconds", b"Delay between due time and run of a task",
+             b"co2_scheduler_lag_max_seconds", b"Longest delay between due time and run of a task", self.scheduler.lag, b""),
+        ]
+        for job in self.scheduler.jobs:
+            histograms.append((b"co2_task_duration_seconds", b"Run time of the scheduled tasks",
+                b"co2_task_duration_max_seconds", b"Longest run time of the scheduled tasks", job.run_time, b'task="%s"' % job.name.encode()))
+        for name, help, _, _, histogram, labels in histograms:
+            yield from writer.histogram(name, help, histogram, labels)
+        # the maxima come after all histograms, the samples of a metric must not be interleaved with others
+        for _, _, name, help, histogram, labels in histograms:
+            if writer.maximum(name, help, histogram, labels):
+                yield writer.flush()
+        yield writer.flush()
 
     def wifi_on_boot(self, set_setting=None):
         if set_setting is None:
@@ -136,7 +326,7 @@ class Application:
             self.display.update()
             await asyncio.sleep(0.1)
         while self.sensor.ppm == 500 or self.sensor.ppm == 515 or self.sensor.ppm == -1:
-            self.sensor.get_data()
+            await self.sensor.read()
             self.update_status("warmup, waiting 500")
             for i in range(10):
                 self.display.update()
@@ -146,103 +336,106 @@ class Application:
         self.warmuped = True
 
     async def handle_sensor(self):
+        start = time.ticks_us()
+        result = await self.sensor.read()
+        self.sensor_latency.record(time.ticks_diff(time.ticks_us(), start))
+        self.sensor_reads += 1
+        if result == 1:
+            self.display.reset_ticks()
+            self.scheduler.schedule(self.display_job)
+            color = "FFFFFF"
+            rating = ""
+            for threshold, color_of_threshold, rating_of_threshold in COLOR_PPM_HEX:
+                color = color_of_threshold
+                rating = rating_of_threshold
+                if threshold > self.sensor.ppm:
+                    break
+            self.update_status("valueok", values={"ppm": self.sensor.ppm, "temp": self.sensor.temp, "co2status": self.sensor.co2status, "color": color, "rating": rating})
+            self.failed_readings = 0
+        else:
+            self.sensor_failures += 1
+            self.failed_readings += 1
+            if self.failed_readings > 5:
+                self.sensor.ppm = -1
+            self.update_status("read not successful")
+        self.gc.maybe_collect()
+
+    def restore_history(self):
+        # refills the RAM tiers with the newest records of the flash log in log order, only as many as
+        # the minute tier holds to keep the boot short. The time the device was off is unknown, the
+        # clock starts over at every power-up, so it leaves no gap
+        if not self.history_log.available:
+            return
+        try:
+            for _, ppm, _ in self.history_log.records(self.history.minutes.max_size):
+                self.history.append(ppm)
+        except OSError as error:
+            print("history restore failed:", repr(error))
+            self.history_log.errors += 1
+
+    def handle_history(self):
+        self.history.append(self.sensor.ppm)
+        self.history_log.append(self.sensor.ppm, self.sensor.temp)
+
+    def handle_display(self):
+        self.display.update()
+        if self.display.animating():
+            return 10
+        return 500 # still refresh now and then to follow the orientation
+
+    async def handle_button(self):
         while True:
-            if time.ticks_diff(time.ticks_ms(), self.last_reading) > 2000:
-                if self.sensor.get_data() == 1:
-                    self.display.reset_ticks()
-                    color = "FFFFFF"
-                    rating = ""
-                    for threshold, color_of_threshold, rating_of_threshold in COLOR_PPM_HEX:
-                        color = color_of_threshold
-                        rating = rating_of_threshold
-                        if threshold > self.sensor.ppm:
-                            break
-                    self.update_status("valueok", values={"ppm": self.sensor.ppm, "temp": self.sensor.temp, "co2status": self.sensor.co2status, "color": color, "rating": rating})
-                    self.failed_readings = 0
+            await self.button.wait_for(True)
+            await self.menu()
+            self.display.set_state("display")
+            self.scheduler.schedule(self.display_job)
+            await self.button.wait_for(False)
+
+    async def menu(self):
+        state = -1
+        while await self.button.wait_for(True, 15000): # quit menu after 15 sec
+            pressed_since = time.ticks_ms()
+            if not await self.button.wait_for(False, 2000):
+                if state == -1:
+                    state = 0
                 else:
-                    self.failed_readings += 1
-                    if self.failed_readings > 5:
-                        self.sensor.ppm = -1
-                    self.update_status("read not successful")
-                self.last_reading = time.ticks_ms()
-            if time.ticks_diff(time.ticks_ms(), self.last_ring_buffer_append) > 60000:
-                self.ring_buffer.append(self.sensor.ppm)
-                self.last_ring_buffer_append = time.ticks_ms()
-            await asyncio.sleep(0.01)
-
-    async def handle_button_and_display(self):
-        while True:
-            if not self.matrix.get_button_status():
-                in_menu_since = time.ticks_ms()
-                state = -1
-                while time.ticks_diff(time.ticks_ms(), in_menu_since) < 15000: # quit menu after 15 sec
-                    if not self.matrix.get_button_status():
-                        pressed_since = time.ticks_ms()
-                        while not self.matrix.get_button_status() and time.ticks_diff(time.ticks_ms(), pressed_since) < 2000:
-                            time.sleep(0.1)
-                        if time.ticks_diff(time.ticks_ms(), pressed_since) >= 2000:
-                            if state == -1:
-                                state = 0
-                            elif state == 0:
-                                self.display.set_state("applied_cali")
-                                if not self.sensor.zero_point_calibration():
-                                    self.display.set_state("error")
-                                    while True:
-                                        pass
-                                time.sleep(2)
-                                break
-                            elif state == 1:
-                                self.display.set_state("applied_on")
-                                if not self.sensor.enable_self_calibration():
-                                    self.display.set_state("error")
-                                    while True:
-                                        pass
-                                time.sleep(2)
-                                break
-                            elif state == 2:
-                                self.display.set_state("applied_off")
-                                if not self.sensor.disable_self_calibration():
-                                    self.display.set_state("error")
-                                    while True:
-                                        pass
-                                time.sleep(2)
-                                break
-                        elif state == -1 and time.ticks_diff(time.ticks_ms(), pressed_since) >= 100:
-                            wifi_state = not self.ap.active()
-                            self.ap.active(wifi_state)
-                            self.display.set_state("wifi_on" if wifi_state else "wifi_off")
-                            time.sleep(2)
-                            break
-                        else:
-                            if state == -1:
-                                break
-                            else:
-                                state = (state + 1) % 3
-                        if state >= 0:
-                            self.display.set_state(("setting_cali", "setting_on", "setting_off")[state])
-                            self.display.update()
-                        time.sleep(1)
-                        in_menu_since = time.ticks_ms()
-                    time.sleep(0.1)
-                self.display.set_state("display")
+                    await self.apply_setting(state)
+                    return
+            elif state == -1 and time.ticks_diff(time.ticks_ms(), pressed_since) >= 100:
+                wifi_state = not self.ap.active()
+                self.ap.active(wifi_state)
+                self.display.set_state("wifi_on" if wifi_state else "wifi_off")
+                await asyncio.sleep(2)
+                return
+            elif state == -1:
+                return
+            else:
+                state = (state + 1) % 3
+            self.display.set_state(("setting_cali", "setting_on", "setting_off")[state])
+            await asyncio.sleep(1)
 
-            self.display.update()
-            await asyncio.sleep(0.01)
+    async def apply_setting(self, state: int):
+        name, action = (("cali", self.sensor.zero_point_calibration), ("on", self.sensor.enable_self_calibration), ("off", self.sensor.disable_self_calibration))[state]
+        self.display.set_state("applied_" + name)
+        if not action():
+            self.display.set_state("error")
+            while True: # stay in the error state, the other tasks keep running
+                await asyncio.sleep(60)
+        await asyncio.sleep(2)
 
-    async def handle_gc(self):
-        while True:
-            gc.collect()
-            await asyncio.sleep(0.01)
+    def handle_gc(self):
+        self.gc.maybe_collect()
 
 
-async def main():
+async def main(port:int=80):
     matrix = atom.Matrix()
     sensor = mhz19.MHZ19(2, tx=33, rx=23)
-    direction_sensor = DirectionSensor(21, 25)
+    direction_sensor = DirectionSensor(21, 25, hardware_i2c=True)
     display = Display(matrix._np, sensor, direction_sensor, brightness=20)
-    application = Application(matrix, display, sensor, webserver=True)
+    application = Application(matrix, display, sensor, webserver=True, port=port)
 
     await application.run()
 
 
-asyncio.run(main())
+if __name__ == "__main__": # main.py runs as __main__ on boot, the simulator imports it
+    asyncio.run(main())
@@ -0,0 +1,121 @@
+# bucket upper bounds in microseconds, the last bucket takes everything above
+DURATION_BOUNDS_US = (100, 500, 1000, 5000, 10000, 50000, 100000, 500000, 1000000)
+# bucket upper bounds in milliseconds for wakeup lag
+LAG_BOUNDS_MS = (1, 2, 5, 10, 50, 100, 500, 1000)
+
+
+class Histogram:
+    """
+    Fixed bucket histogram, recording allocates nothing so it can stay
+    enabled on the device. The sum is kept as seconds plus remainder to
+    stay within small ints.
+    """
+
+    def __init__(self, bounds:tuple=DURATION_BOUNDS_US, unit_per_second:int=1000000) -> None:
+        self.bounds = bounds
+        self.buckets = [0] * (len(bounds) + 1)
+        self.unit_per_second = unit_per_second
+        self.count = 0
+        self.max = 0
+        self.sum_seconds = 0
+        self.sum_remainder = 0
+
+    def record(self, value:int):
+        index = 0
+        bounds = self.bounds
+        while index < len(bounds) and value > bounds[index]:
+            index += 1
+        self.buckets[index] += 1
+        self.count += 1
+        if value > self.max:
+            self.max = value
+        self.sum_remainder += value
+        while self.sum_remainder >= self.unit_per_second:
+            self.sum_remainder -= self.unit_per_second
+            self.sum_seconds += 1
+
+
+class PrometheusWriter:
+    """
+    Streams the Prometheus text format as chunks of one reused buffer.
+    Sample prefixes (name and labels) are formatted to bytes once and cached
+    across scrapes, per scrape only the numbers are formatted. Use as:
+
+        def metrics():
+            writer = PrometheusWriter()
+            if writer.gauge(b"co2_ppm", b"CO2 concentration", ppm): yield writer.flush()
+            ...
+            yield writer.flush()
+    """
+    FLUSH_AT = 768 # single entries stay well below the remaining 256 bytes
+    _templates = {} # shared by all writers, only the buffer is per scrape
+
+    def __init__(self, size:int=1024) -> None:
+        self.buffer = bytearray(size)
+        self.view = memoryview(self.buffer)
+        self.length = 0
+        self._headers = set()
+
+    def _add(self, data) -> bool:
+        end = self.length + len(data)
+        self.buffer[self.length:end] = data
+        self.length = end
+        return end >= self.FLUSH_AT
+
+    def flush(self):
+        length = self.length
+        self.length = 0 # the consumer writes the chunk before the generator resumes
+        return self.view[:length]
+
+    def _header(self, name:bytes, help:bytes, kind:bytes):
+        if name not in self._headers:
+            self._headers.add(name)
+            self._add(b"# HELP %s %s\n# TYPE %s %s\n" % (name, help, name, kind))
+
+    def _sample(self, name:bytes, labels:bytes, value) -> bool:
+        key = (name, labels)
+        prefix = self._templates.get(key)
+        if prefix is None:
+            prefix = name + (b"{" + labels + b"}" if labels else b"") + b" "
+            self._templates[key] = prefix
+        self._add(prefix)
+        return self._add(b"%d\n" % value if isinstance(value, int) else b"%f\n" % value)
+
+    def gauge(self, name:bytes, help:bytes, value, labels:bytes=b"") -> bool:
+        self._header(name, help, b"gauge")
+        return self._sample(name, labels, value)
+
+    def counter(self, name:bytes, help:bytes, value, labels:bytes=b"") -> bool:
+        self._header(name, help, b"counter")
+        return self._sample(name, labels, value)
+
+    def histogram(self, name:bytes, help:bytes, histogram:Histogram, labels:bytes=b""):
+        """Generator yielding full chunks, the histogram values are converted to seconds."""
+        self._header(name, help, b"histogram")
+        key = (name, labels, histogram.bounds)
+        templates = self._templates.get(key)
+        if templates is None:
+            separator = labels + b"," if labels else b""
+            bucket = name + b"_bucket{" + separator + b"le=\""
+            templates = tuple(bucket + (b"%g" % (bound / histogram.unit_per_second)) + b"\"} " for bound in histogram.bounds) + (
+                bucket + b"+Inf\"} ",
+                name + b"_sum" + (b"{" + labels + b"}" if labels else b"") + b" ",
+                name + b"_count" + (b"{" + labels + b"}" if labels else b"") + b" ",
+            )
+            self._templates[key] = templates
+        cumulative = 0
+        for index in range(len(histogram.buckets)):
+            cumulative += histogram.buckets[index]
+            self._add(templates[index])
+            if self._add(b"%d\n" % cumulative):
+                yield self.flush()
+        self._add(templates[-2])
+        self._add(b"%d.%06d\n" % (histogram.sum_seconds, histogram.sum_remainder * (1000000 // histogram.unit_per_second)))
+        self._add(templates[-1])
+        if self._add(b"%d\n" % histogram.count):
+            yield self.flush()
+
+    def maximum(self, name:bytes, help:bytes, histogram:Histogram, labels:bytes=b"") -> bool:
+        """Largest recorded value of histogram in seconds as gauge, the buckets only bound it."""
+        self._header(name, help, b"gauge")
+        return self._sample(name, labels, histogram.max / histogram.unit_per_second)
@@ -26,6 +26,100 @@ It will tell you
 from machine import UART
 import time
 import sys
+import uasyncio as asyncio
+
+
+def _crc8_python(buf) -> int:
+    # two's complement of the sum of bytes 1 to 7, indexes the buffer directly so memoryviews are not copied
+    crc = 0x00
+    for i in range(1, 8):
+        crc += buf[i]
+    return (~crc + 1) & 0xFF
+
+
+try:
+    import micropython
+
+    @micropython.viper
+    def _crc8_viper(buf) -> int:
+        b = ptr8(buf)
+        crc = 0
+        for i in range(1, 8):
+            crc += b[i]
+        return (~crc + 1) & 0xFF
+
+    crc8 = _crc8_viper
+except (ImportError, AttributeError):
+    # CPython or a stub micropython module (sim/, benchmark/). On a MicroPython port without the
+    # viper emitter the decorator is a SyntaxError at compile time, this except cannot catch that
+    crc8 = _crc8_python
+
+
+def command(byte2:int, byte3:int = 0x00, byte4:int = 0x00, byte5:int = 0x00, byte6:int = 0x00, byte7:int = 0x00) -> bytes:
+    """Builds a complete 9 byte command frame including the checksum."""
+    frame = bytearray(b"\xff\x01\x00\x00\x00\x00\x00\x00\x00")
+    frame[2] = byte2
+    frame[3] = byte3
+    frame[4] = byte4
+    frame[5] = byte5
+    frame[6] = byte6
+    frame[7] = byte7
+    frame[8] = crc8(frame)
+    return bytes(frame)
+
+
+# fixed command frames, checksums are computed once at import
+READ_CO2 = command(0x86)
+READ_CO2_UNLIMITED = command(0x85)
+ABC_OFF = command(0x79, 0x00)
+ABC_ON = command(0x79, 0xA0)
+ABC_STATUS = command(0x7D)
+FIRMWARE_VERSION = command(0xA0)
+ZERO_POINT_CALIBRATION = command(0x87)
+
+# commands the sensor answers, the reply echoes the command in byte 1
+REPLY_COMMANDS = bytes((0x86, 0x85, 0x7D, 0xA0))
+
+
+class FrameDecoder:
+    """
+    Streaming decoder for the 9 byte responses (0xFF, command, ...).
+    Bytes are fed one at a time, garbage before a header is skipped and
+    after a checksum error the decoder resynchronizes on the bytes of the
+    rejected frame, so no UART restart is needed.
+    """
+
+    def __init__(self, crc8, commands:bytes = b"\x86") -> None:
+        self.crc8 = crc8
+        self.commands = commands
+        self.frame = bytearray(9)
+        self.crc_errors = 0
+        self._pos = 0
+
+    def reset(self):
+        self._pos = 0
+
+    def feed(self, byte:int) -> bool:
+        """Returns True when self.frame holds a complete frame with valid checksum."""
+        pos = self._pos
+        if (pos == 0 and byte != 0xFF) or (pos == 1 and byte not in self.commands):
+            self._pos = 1 if byte == 0xFF else 0
+            return False
+        self.frame[pos] = byte
+        pos += 1
+        if pos < 9:
+            self._pos = pos
+            return False
+        self._pos = 0
+        if self.crc8(self.frame) == self.frame[8]:
+            return True
+        self.crc_errors += 1
+        print('CRC error bytes= %d:%d:%d:%d:%d:%d:%d:%d crc= %d' % tuple(self.frame))
+        # the real header may be somewhere inside the rejected frame,
+        # the remaining 8 bytes are too short to complete a frame on their own
+        for byte in bytes(self.frame[1:]):
+            self.feed(byte)
+        return False
 
 
 class MHZ19:
@@ -33,68 +127,146 @@ class MHZ19:
         self.uart_no = uart_no
         self.tx = tx
         self.rx = rx
+        self.decoder = FrameDecoder(crc8, REPLY_COMMANDS)
+        self._rx = bytearray(9)
+        self._waiters = {} # reply command -> (Event, reply frame)
+        self._reader = None
         self.start()
         self.ppm = -1
         self.temp = 0
         self.co2status = 0
+        self.ppm_unlimited = -1
+        self.abc_enabled = None # unknown until queried
+        self.firmware_version = None
 
     def start(self):
         self.uart = UART(self.uart_no, 9600, tx=self.tx, rx=self.rx)
         self.uart.init(9600, bits=8, parity=None, stop=1, timeout=10, tx=self.tx, rx=self.rx)
+        self.stream = asyncio.StreamReader(self.uart)
+        self.decoder.reset()
 
     def stop(self):
+        if self._reader is not None:
+            self._reader.cancel()
+            self._reader = None
         while self.uart.any():
             self.uart.read(1)
         self.uart.deinit()
 
-    def _send_comand(self, byte2:bytes, byte3:bytes = b"\x00") -> bool:
-        command = b"\xff\x01" + byte2 + byte3 + b"\x00\x00\x00\x00"
-        return self.uart.write(command + self.crc8(command).to_bytes(1, "big")) == 9
+    async def restart(self):
+        self.stop()
+        await asyncio.sleep(1)
+        self.start()
+
+    def _send_comand(self, frame:bytes) -> bool:
+        return self.uart.write(frame) == 9
 
     def disable_self_calibration(self) -> bool:
-        return self._send_comand(b"\x79", b"\x00")
+        return self._send_comand(ABC_OFF)
 
     def enable_self_calibration(self) -> bool:
-        return self._send_comand(b"\x79", b"\xA0")
+        return self._send_comand(ABC_ON)
 
     def zero_point_calibration(self) -> bool:
-        return self._send_comand(b"\x87")
+        return self._send_comand(ZERO_POINT_CALIBRATION)
+
+    def span_point_calibration(self, ppm:int) -> bool:
+        return self._send_comand(command(0x88, ppm >> 8, ppm & 0xFF))
+
+    def set_range(self, ppm:int) -> bool:
+        """Detection range, usually 2000, 5000 or 10000 ppm."""
+        return self._send_comand(command(0x99, 0x00, 0x00, 0x00, ppm >> 8, ppm & 0xFF))
 
     def get_data(self) -> int:
-        self.uart.write(b"\xff\x01\x86\x00\x00\x00\x00\x00\x79")
+        """Blocking read, only for use without the asyncio reader (read, request, query_info)."""
+        self.uart.write(READ_CO2)
         time.sleep(0.1)
-        s = self.uart.read(9)
+        result = 0
+        while self.uart.any():
+            result |= self._feed(self.uart.readinto(self._rx))
+        return result
+
+    async def read(self, timeout:float=0.5) -> int:
+        """Like get_data, but awaits the reply instead of blocking the event loop."""
+        return 0 if await self.request(READ_CO2, timeout) is None else 1
+
+    async def request(self, frame:bytes, timeout:float=0.5):
+        """Sends a command and awaits its reply frame, None on timeout."""
+        return await self._wait(self._send(frame), timeout)
+
+    async def get_abc_status(self, timeout:float=0.5):
+        await self.query_info(timeout, (ABC_STATUS,))
+        return self.abc_enabled
+
+    async def query_info(self, timeout:float=0.5, frames:tuple = (ABC_STATUS, FIRMWARE_VERSION, READ_CO2_UNLIMITED)) -> int:
+        """
+        Sends all queries back to back and awaits the replies together, so a
+        batch costs one round trip instead of one per command.
+        Updates abc_enabled, firmware_version and ppm_unlimited, returns the
+        number of answered queries.
+        """
+        waiters = [self._send(frame) for frame in frames]
+        replies = await asyncio.gather(*[self._wait(waiter, timeout) for waiter in waiters])
+        return sum(1 for reply in replies if reply is not None)
+
+    def _send(self, frame:bytes):
+        # waiters are reused per command, so only one request per command may be in flight
+        waiter = self._waiters.get(frame[2])
+        if waiter is None:
+            waiter = (asyncio.Event(), bytearray(9))
+            self._waiters[frame[2]] = waiter
+        waiter[0].clear()
+        if self._reader is None:
+            self._reader = asyncio.create_task(self._read_loop())
+        self.uart.write(frame)
+        return waiter
+
+    async def _wait(self, waiter, timeout:float):
         try:
-            z = bytearray(s)
-        except:
-            return 0
-        # Calculate crc
-        crc = self.crc8(s)
-        if crc != z[8]:
-            # we should restart the uart comm here..
-            self.stop()
-            time.sleep(1)
-            self.start()
-
-            print('CRC error calculated %d bytes= %d:%d:%d:%d:%d:%d:%d:%d crc= %dn' % (
-                crc, z[0], z[1], z[2], z[3], z[4], z[5], z[6], z[7], z[8]))
-            return 0
-        else:
-            self.ppm = ord(chr(s[2])) * 256 + ord(chr(s[3]))
-            self.temp = ord(chr(s[4])) - 40
-            self.co2status = ord(chr(s[5]))
-            return 1
+            await asyncio.wait_for(waiter[0].wait(), timeout)
+        except asyncio.TimeoutError:
+            return None
+        return waiter[1]
+
+    async def _read_loop(self):
+        while True:
+            self._feed(await self.stream.readinto(self._rx))
+
+    def _feed(self, count) -> int:
+        # consumes the first count bytes of self._rx, returns 1 if a co2 reading was decoded
+        result = 0
+        if count:
+            rx = self._rx
+            for i in range(count):
+                if self.decoder.feed(rx[i]):
+                    result |= self._dispatch(self.decoder.frame)
+        return result
+
+    def _dispatch(self, frame) -> int:
+        reply = frame[1]
+        result = 0
+        if reply == 0x86:
+            self._decode(frame)
+            result = 1
+        elif reply == 0x85:
+            self.ppm_unlimited = frame[4] * 256 + frame[5]
+        elif reply == 0x7D:
+            self.abc_enabled = frame[7] == 1
+        elif reply == 0xA0:
+            try:
+                self.firmware_version = bytes(frame[2:6]).decode()
+            except UnicodeError:
+                self.firmware_version = "?"
+        waiter = self._waiters.get(reply)
+        if waiter is not None:
+            waiter[1][:] = frame
+            waiter[0].set()
+        return result
+
+    def _decode(self, s):
+        self.ppm = s[2] * 256 + s[3]
+        self.temp = s[4] - 40
+        self.co2status = s[5]
 
     def crc8(self, a) -> int:
-        crc = 0x00
-        count = 1
-        b = bytearray(a)
-        while count < 8:
-            crc += b[count]
-            count = count+1
-        # Truncate to 8 bit
-        crc %= 256
-        # Invert number with xor
-        crc = ~crc & 0xFF
-        crc += 1
-        return crc
+        return crc8(a)
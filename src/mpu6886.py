@@ -33,10 +33,18 @@ from machine import I2C, Pin
 from micropython import const
 # pylint: enable=import-error
 
+_SMPLRT_DIV = const(0x19)
 _CONFIG = const(0x1a)
 _GYRO_CONFIG = const(0x1b)
 _ACCEL_CONFIG = const(0x1c)
 _ACCEL_CONFIG2 = const(0x1d)
+_ACCEL_WOM_X_THR = const(0x20)
+_ACCEL_WOM_Y_THR = const(0x21)
+_ACCEL_WOM_Z_THR = const(0x22)
+_FIFO_EN = const(0x23)
+_INT_PIN_CFG = const(0x37)
+_INT_ENABLE = const(0x38)
+_INT_STATUS = const(0x3a)
 _ACCEL_XOUT_H = const(0x3b)
 _ACCEL_XOUT_L = const(0x3c)
 _ACCEL_YOUT_H = const(0x3d)
@@ -51,9 +59,33 @@ _GYRO_YOUT_H = const(0x45)
 _GYRO_YOUT_L = const(0x46)
 _GYRO_ZOUT_H = const(0x47)
 _GYRO_ZOUT_L = const(0x48)
+_ACCEL_INTEL_CTRL = const(0x69)
+_USER_CTRL = const(0x6a)
 _PWR_MGMT_1 = const(0x6b)
+_PWR_MGMT_2 = const(0x6c)
+_FIFO_COUNTH = const(0x72)
+_FIFO_R_W = const(0x74)
 _WHO_AM_I = const(0x75)
 
+_CONFIG_FIFO_MODE = const(0b01000000) # do not overwrite old data when full
+_FIFO_EN_GYRO = const(0b00010000)
+_FIFO_EN_ACCEL = const(0b00001000)
+_USER_CTRL_FIFO_EN = const(0b01000000)
+_USER_CTRL_FIFO_RST = const(0b00000100)
+_INT_PIN_CFG_ACTIVE_LOW = const(0b10000000)
+_INT_PIN_CFG_OPEN_DRAIN = const(0b01000000)
+_INT_PIN_CFG_LATCH = const(0b00100000)
+_INT_PIN_CFG_ANY_READ_CLEAR = const(0b00010000)
+_ACCEL_INTEL_EN = const(0b10000000)
+_ACCEL_INTEL_COMPARE_PREVIOUS = const(0b01000000)
+
+INT_WOM_X = const(0b10000000)
+INT_WOM_Y = const(0b01000000)
+INT_WOM_Z = const(0b00100000)
+INT_WOM = const(0b11100000)
+INT_FIFO_OVERFLOW = const(0b00010000)
+INT_DATA_READY = const(0b00000001)
+
 ACCEL_FS_SEL_2G = const(0b00000000)
 ACCEL_FS_SEL_4G = const(0b00001000)
 ACCEL_FS_SEL_8G = const(0b00010000)
@@ -92,6 +124,7 @@ class MPU6886:
     ):
         self.i2c = i2c
         self.address = address
+        self._fifo_packet_size = 0 # FIFO disabled after the reset below
 
         if 0x19 != self.whoami:
             raise RuntimeError("MPU6886 not found in I2C bus.")
@@ -120,6 +153,22 @@ class MPU6886:
         xyz = self._register_three_shorts(_ACCEL_XOUT_H)
         return tuple([value / so * sf for value in xyz])
 
+    @property
+    def acceleration_raw(self):
+        """
+        Acceleration as a 3-tuple of the raw signed 16 bit register values
+        of the X, Y and Z axis. No float scaling is done, enough for
+        comparing signs and magnitudes.
+        """
+        return self._register_three_shorts(_ACCEL_XOUT_H)
+
+    def read_raw(self):
+        """
+        Reads accelerometer, temperature and gyro in one 14 byte burst and
+        returns the raw values as 7-tuple ax, ay, az, temp, gx, gy, gz.
+        """
+        return self._register_burst(_ACCEL_XOUT_H)
+
     @property
     def gyro(self):
         """
@@ -168,6 +217,105 @@ class MPU6886:
         self._gyro_offset = (ox / n, oy / n, oz / n)
         return self._gyro_offset
 
+    def sample_rate_divider(self, divider):
+        """
+        Output, FIFO and data ready rate is the internal rate (1 kHz with the
+        default low pass filter) divided by 1 + divider.
+        """
+        self._register_char(_SMPLRT_DIV, divider)
+
+    def enable_fifo(self, accel=True, gyro=False):
+        """
+        Resets and starts the FIFO. Each sample adds a packet of the enabled
+        sensors in register order, the temperature is always included:
+        6 bytes accel, 2 bytes temp, 6 bytes gyro, see fifo_packet_size.
+        """
+        self._fifo_packet_size = (6 if accel else 0) + 2 + (6 if gyro else 0)
+        self._register_char(_USER_CTRL, 0)
+        self._register_char(_FIFO_EN, (_FIFO_EN_ACCEL if accel else 0) | (_FIFO_EN_GYRO if gyro else 0))
+        self._register_char(_CONFIG, self._register_char(_CONFIG) | _CONFIG_FIFO_MODE)
+        self._register_char(_USER_CTRL, _USER_CTRL_FIFO_RST)
+        self._register_char(_USER_CTRL, _USER_CTRL_FIFO_EN)
+
+    def disable_fifo(self):
+        self._register_char(_FIFO_EN, 0)
+        self._register_char(_USER_CTRL, _USER_CTRL_FIFO_RST)
+        self._fifo_packet_size = 0
+
+    @property
+    def fifo_packet_size(self):
+        """ Bytes per sample in the FIFO, 0 if the FIFO is disabled. """
+        return self._fifo_packet_size
+
+    @property
+    def fifo_count(self):
+        """ Number of bytes waiting in the FIFO. """
+        return self._register_short(_FIFO_COUNTH) & 0x1fff
+
+    def read_fifo(self, buf):
+        """
+        Drains as many complete packets as fit into buf with a single I2C
+        read and returns the number of bytes written to buf. Use
+        unpack_fifo to iterate over the raw values.
+        """
+        size = self.fifo_packet_size
+        if size == 0:
+            return 0
+        count = min(self.fifo_count, len(buf))
+        count -= count % size
+        if count:
+            self.i2c.readfrom_mem_into(self.address, _FIFO_R_W, memoryview(buf)[:count])
+        return count
+
+    def unpack_fifo(self, buf, count):
+        """ Yields a tuple of raw shorts for every packet read by read_fifo. """
+        size = self.fifo_packet_size
+        fmt = ">" + "h" * (size // 2)
+        for offset in range(0, count - count % size, size):
+            yield ustruct.unpack_from(fmt, buf, offset)
+
+    def configure_interrupt_pin(self, active_low=False, open_drain=False, latch=False):
+        """
+        Electrical behaviour of the INT pin. Without latch a 50 us pulse is
+        sent, with latch the pin is held until interrupt_status is read.
+        """
+        value = _INT_PIN_CFG_ANY_READ_CLEAR if latch else 0
+        if active_low:
+            value |= _INT_PIN_CFG_ACTIVE_LOW
+        if open_drain:
+            value |= _INT_PIN_CFG_OPEN_DRAIN
+        if latch:
+            value |= _INT_PIN_CFG_LATCH
+        self._register_char(_INT_PIN_CFG, value)
+
+    def enable_interrupts(self, interrupts):
+        """ Enables the given INT_* flags on the INT pin, 0 disables all. """
+        self._register_char(_INT_ENABLE, interrupts)
+
+    def enable_wake_on_motion(self, threshold_mg=64, divider=19):
+        """
+        Raises INT_WOM when the acceleration of any axis changed by more than
+        threshold_mg (4 mg steps, up to 1020 mg) between two samples.
+        Samples are taken at 1 kHz / (1 + divider). Keeps the other sensors
+        and the output registers running, so regular reads still work.
+        """
+        threshold = min(max(threshold_mg // 4, 1), 255)
+        self._register_char(_ACCEL_WOM_X_THR, threshold)
+        self._register_char(_ACCEL_WOM_Y_THR, threshold)
+        self._register_char(_ACCEL_WOM_Z_THR, threshold)
+        self._register_char(_ACCEL_INTEL_CTRL, _ACCEL_INTEL_EN | _ACCEL_INTEL_COMPARE_PREVIOUS)
+        self.sample_rate_divider(divider)
+        self.enable_interrupts(self._register_char(_INT_ENABLE) | INT_WOM)
+
+    def disable_wake_on_motion(self):
+        self._register_char(_ACCEL_INTEL_CTRL, 0)
+        self.enable_interrupts(self._register_char(_INT_ENABLE) & ~INT_WOM & 0xff)
+
+    @property
+    def interrupt_status(self):
+        """ INT_* flags that fired since the last read, reading clears them. """
+        return self._register_char(_INT_STATUS)
+
     def _register_short(self, register, value=None, buf=bytearray(2)):
         if value is None:
             self.i2c.readfrom_mem_into(self.address, register, buf)
@@ -180,12 +328,16 @@ class MPU6886:
         self.i2c.readfrom_mem_into(self.address, register, buf)
         return ustruct.unpack(">hhh", buf)
 
+    def _register_burst(self, register, buf=bytearray(14)):
+        self.i2c.readfrom_mem_into(self.address, register, buf)
+        return ustruct.unpack(">hhhhhhh", buf)
+
     def _register_char(self, register, value=None, buf=bytearray(1)):
         if value is None:
             self.i2c.readfrom_mem_into(self.address, register, buf)
             return buf[0]
 
-        ustruct.pack_into("<b", buf, 0, value)
+        ustruct.pack_into("<B", buf, 0, value)
         return self.i2c.writeto_mem(self.address, register, buf)
 
     def _accel_fs(self, value):
@@ -1,23 +1,206 @@
+from array import array
+import struct
+
+# binary history: this header, then every series as int16 little endian samples
+# version, number of series, interval in minutes, samples per series, capacity, start time, number of the first sample
+BINARY_HEADER = "<BBHHHII"
+BINARY_VERSION = 2
+
+
+def binary_header(series:int, interval:int, count:int, capacity:int, start:int, first:int) -> bytes:
+    return struct.pack(BINARY_HEADER, BINARY_VERSION, series, interval, count, capacity, start, first)
+
+
+def count_since(total:int, length:int, since=None) -> int:
+    # samples newer than the cursor since, all if the cursor is unknown (too old, or from before a reboot)
+    newer = length if since is None else total - since
+    return newer if 0 <= newer <= length else length
+
 
 class RingBuffer:
-    def __init__(self, max_size:int) -> None:
+    def __init__(self, max_size:int, typecode:str="h") -> None:
         self._max_size = max_size
-        self._buffer = list()
+        self._buffer = array(typecode, (0 for _ in range(max_size)))
+        self._view = memoryview(self._buffer)
+        self._head = 0 # next write position
+        self._len = 0
+        self._total = 0 # samples ever appended, numbers the samples for since cursors
 
     @property
     def max_size(self) -> int:
         return self._max_size
 
     def append(self, elem):
-        self._buffer.append(elem)
-        if len(self._buffer) > self._max_size:
-            self._buffer.pop(0)
+        self._buffer[self._head] = elem
+        self._head += 1
+        if self._head == self._max_size:
+            self._head = 0
+        if self._len < self._max_size:
+            self._len += 1
+        self._total += 1
+
+    @property
+    def total(self) -> int:
+        return self._total
+
+    def count_since(self, since=None) -> int:
+        return count_since(self._total, self._len, since)
 
     def clear(self):
-        self._buffer = list()
+        self._head = 0
+        self._len = 0
 
     def __len__(self) -> int:
-        return len(self._buffer)
+        return self._len
+
+    def __getitem__(self, index:int):
+        if index < 0:
+            index += self._len
+        if not 0 <= index < self._len:
+            raise IndexError("ring buffer index out of range")
+        return self._buffer[(self._head - self._len + index) % self._max_size]
+
+    def slices(self, count=None) -> tuple:
+        # oldest to newest of the newest count values as two views into the storage, no copy
+        if count is None or count > self._len:
+            count = self._len
+        start = self._head - count
+        if start >= 0:
+            return self._view[start:self._head], self._view[:0]
+        return self._view[start + self._max_size:], self._view[:self._head]
+
+    def _iter_since(self, since=None):
+        for part in self.slices(self.count_since(since)):
+            for elem in part:
+                yield elem
+
+    def __iter__(self):
+        return self._iter_since()
 
     def get_list(self) -> list:
-        return self._buffer
+        return list(self)
+
+    def iter_json(self, chunk_size:int=32, since=None):
+        # stream as json array in chunks, avoids building the full string
+        yield "["
+        separator = ""
+        chunk = []
+        for elem in self._iter_since(since):
+            chunk.append(elem)
+            if len(chunk) == chunk_size:
+                yield separator + ",".join(str(value) for value in chunk)
+                separator = ","
+                chunk.clear()
+        if chunk:
+            yield separator + ",".join(str(value) for value in chunk)
+        yield "]"
+
+    def iter_binary(self, start:int=0, since=None):
+        count = self.count_since(since)
+        yield binary_header(1, 1, count, self._max_size, start, self._total - count)
+        yield from self.iter_storage(count)
+
+    def iter_storage(self, count=None, chunk_size:int=64):
+        # the storage as bytes, int16 is little endian on the ESP32. Copies of chunk_size samples:
+        # len() of an array view counts items, writers resuming a partial send slice it by bytes
+        for part in self.slices(count):
+            for offset in range(0, len(part), chunk_size):
+                yield bytes(part[offset:offset + chunk_size])
+
+
+class AggregateRingBuffer:
+    # min/mean/max of every bucket_size appended values, negative values count as missing
+    def __init__(self, max_size:int, bucket_size:int) -> None:
+        self.bucket_size = bucket_size
+        self.min = RingBuffer(max_size)
+        self.mean = RingBuffer(max_size)
+        self.max = RingBuffer(max_size)
+        self._reset_bucket()
+
+    @property
+    def max_size(self) -> int:
+        return self.mean.max_size
+
+    def _reset_bucket(self):
+        self._count = 0
+        self._valid = 0
+        self._sum = 0
+        self._min = 0
+        self._max = 0
+
+    def append(self, elem):
+        if elem >= 0:
+            if self._valid == 0 or elem < self._min:
+                self._min = elem
+            if self._valid == 0 or elem > self._max:
+                self._max = elem
+            self._sum += elem
+            self._valid += 1
+        self._count += 1
+        if self._count >= self.bucket_size:
+            if self._valid:
+                self.min.append(self._min)
+                self.mean.append(self._sum // self._valid)
+                self.max.append(self._max)
+            else:
+                self.min.append(-1)
+                self.mean.append(-1)
+                self.max.append(-1)
+            self._reset_bucket()
+
+    def clear(self):
+        self.min.clear()
+        self.mean.clear()
+        self.max.clear()
+        self._reset_bucket()
+
+    def __len__(self) -> int:
+        return len(self.mean)
+
+    @property
+    def total(self) -> int:
+        return self.mean.total
+
+    def count_since(self, since=None) -> int:
+        return self.mean.count_since(since)
+
+    def iter_json(self, chunk_size:int=32, since=None):
+        yield '{"interval":%d,"min":' % self.bucket_size
+        yield from self.min.iter_json(chunk_size, since)
+        yield ',"mean":'
+        yield from self.mean.iter_json(chunk_size, since)
+        yield ',"max":'
+        yield from self.max.iter_json(chunk_size, since)
+        yield "}"
+
+    def iter_binary(self, start:int=0, since=None):
+        count = self.count_since(since)
+        yield binary_header(3, self.bucket_size, count, self.max_size, start, self.total - count)
+        yield from self.min.iter_storage(count)
+        yield from self.mean.iter_storage(count)
+        yield from self.max.iter_storage(count)
+
+
+class TieredHistory:
+    # one value per minute, rolled up incrementally into coarser tiers
+    def __init__(self, minutes:int=60 * 8, ten_minutes:int=6 * 24 * 3, hours:int=24 * 30) -> None:
+        self.tiers = {
+            1: RingBuffer(minutes), # every minute for 8 hours
+            10: AggregateRingBuffer(ten_minutes, 10), # every 10 minutes for 3 days
+            60: AggregateRingBuffer(hours, 60), # every hour for 30 days
+        }
+
+    @property
+    def minutes(self) -> RingBuffer:
+        return self.tiers[1]
+
+    def append(self, elem):
+        for tier in self.tiers.values():
+            tier.append(elem)
+
+    def clear(self):
+        for tier in self.tiers.values():
+            tier.clear()
+
+    def get(self, resolution:int=1):
+        return self.tiers.get(resolution)
@@ -0,0 +1,109 @@
+import time
+import uasyncio as asyncio
+
+from metrics import Histogram, LAG_BOUNDS_MS
+
+
+class Job:
+    def __init__(self, callback, interval_ms:int, name:str) -> None:
+        self.callback = callback
+        self.interval_ms = interval_ms
+        self.name = name
+        self.due = None # ticks_ms of the next run, None if not scheduled
+        self.running = False # coroutine task not finished yet
+        self.run_time = Histogram() # us per run
+
+
+class Scheduler:
+    """
+    Runs jobs at their deadlines from a single task, sleeping until the
+    earliest one is due instead of polling.
+    A callback may return a delay in ms to override its interval for the
+    next run, or a negative value to unschedule itself until schedule() is
+    called again. Callbacks can be plain functions or coroutines, a
+    coroutine runs as its own task and is not due again before it finished.
+    """
+
+    def __init__(self) -> None:
+        self._jobs = []
+        self._wakeup = asyncio.Event()
+        self.lag = Histogram(LAG_BOUNDS_MS, 1000) # ms between due time and actual run
+
+    @property
+    def jobs(self) -> list:
+        return self._jobs
+
+    def every(self, interval_ms:int, callback, delay_ms:int=0, name:str="job") -> Job:
+        job = Job(callback, interval_ms, name)
+        self._jobs.append(job)
+        self.schedule(job, delay_ms)
+        return job
+
+    def schedule(self, job:Job, delay_ms:int=0):
+        if job.running:
+            return # it reschedules itself when done
+        due = time.ticks_add(time.ticks_ms(), delay_ms)
+        if job.due is None or time.ticks_diff(due, job.due) < 0:
+            job.due = due
+            self._wakeup.set()
+
+    def cancel(self, job:Job):
+        job.due = None
+
+    def _run_job(self, job:Job, lag_ms:int):
+        self.lag.record(lag_ms)
+        job.due = None
+        start = time.ticks_us()
+        try:
+            delay = job.callback()
+        except Exception as error:
+            # one failing job (e.g. an I2C OSError) must not stop the others, it runs again at its interval
+            print("job", job.name, "failed:", repr(error))
+            delay = None
+        if hasattr(delay, "send"):
+            # a waiting coroutine must not hold up the other jobs, it reschedules itself when done
+            job.running = True
+            asyncio.create_task(self._finish_job(job, delay, start))
+            return
+        self._reschedule(job, delay, start)
+
+    async def _finish_job(self, job:Job, coroutine, start:int):
+        delay = None
+        try:
+            delay = await coroutine
+        except Exception as error:
+            print("job", job.name, "failed:", repr(error))
+        job.running = False
+        self._reschedule(job, delay, start)
+
+    def _reschedule(self, job:Job, delay, start:int):
+        job.run_time.record(time.ticks_diff(time.ticks_us(), start))
+        if delay is None:
+            delay = job.interval_ms
+        if delay >= 0:
+            self.schedule(job, delay)
+
+    async def run(self):
+        while True:
+            now = time.ticks_ms()
+            for job in self._jobs:
+                if job.due is not None and time.ticks_diff(job.due, now) <= 0:
+                    self._run_job(job, time.ticks_diff(now, job.due))
+            now = time.ticks_ms()
+            sleep_ms = -1
+            for job in self._jobs:
+                if job.due is not None:
+                    remaining = max(time.ticks_diff(job.due, now), 0)
+                    if sleep_ms < 0 or remaining < sleep_ms:
+                        sleep_ms = remaining
+            self._wakeup.clear()
+            if sleep_ms == 0:
+                await asyncio.sleep(0) # let other tasks run between due jobs
+                continue
+            try:
+                if sleep_ms < 0:
+                    await self._wakeup.wait()
+                else:
+                    await asyncio.wait_for(self._wakeup.wait(), sleep_ms / 1000)
+            except asyncio.TimeoutError:
+                pass
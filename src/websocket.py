@@ -0,0 +1,137 @@
+import ubinascii
+import uhashlib
+import ustruct as struct
+import uasyncio as asyncio
+
+GUID = b"258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+CONTINUATION = 0x0
+TEXT = 0x1
+BINARY = 0x2
+CLOSE = 0x8
+PING = 0x9
+PONG = 0xA
+CLOSE_NORMAL = 1000
+CLOSE_GOING_AWAY = 1001
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_INVALID_DATA = 1007
+CLOSE_TOO_BIG = 1009
+
+
+async def accept(request, max_message:int=1024):
+    """
+    Answers the handshake of a microdot_asyncio request and takes over its
+    connection, returns None if the request is no WebSocket upgrade. The
+    route has to return Response.already_handled afterwards.
+    """
+    key = request.headers.get("Sec-WebSocket-Key")
+    if not key or request.headers.get("Upgrade", "").lower() != "websocket":
+        return None
+    accept_key = ubinascii.b2a_base64(uhashlib.sha1(key.encode() + GUID).digest())[:-1] # without the newline
+    reader, writer = request.sock
+    await writer.awrite(b"HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\nSec-WebSocket-Accept: " + accept_key + b"\r\n\r\n")
+    return WebSocket(reader, writer, max_message)
+
+
+class WebSocket:
+    """
+    Minimal server side RFC 6455: text and binary messages, fragmented
+    messages, ping/pong and close. Messages longer than max_message bytes
+    close the connection, the device has no room for large ones.
+    """
+
+    def __init__(self, reader, writer, max_message:int=1024) -> None:
+        self._reader = reader
+        self._writer = writer
+        self._lock = asyncio.Lock() # readings and replies are sent from different tasks
+        self.max_message = max_message
+        self.closed = False
+
+    async def _read_frame(self):
+        header = await self._reader.readexactly(2)
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack("!H", await self._reader.readexactly(2))[0]
+        elif length == 127:
+            length = struct.unpack("!Q", await self._reader.readexactly(8))[0]
+        if not header[1] & 0x80:
+            raise ValueError(CLOSE_PROTOCOL_ERROR) # client frames are always masked
+        if length > self.max_message:
+            raise ValueError(CLOSE_TOO_BIG)
+        mask = await self._reader.readexactly(4)
+        payload = bytearray(await self._reader.readexactly(length)) if length else bytearray()
+        for index in range(length):
+            payload[index] ^= mask[index & 3]
+        return header[0] & 0x80, header[0] & 0x0F, payload
+
+    async def _send_frame(self, opcode:int, payload:bytes=b""):
+        length = len(payload)
+        if length < 126:
+            header = struct.pack("!BB", 0x80 | opcode, length)
+        elif length < 0x10000:
+            header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+        else:
+            header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+        async with self._lock:
+            await self._writer.awrite(header)
+            if length:
+                await self._writer.awrite(payload)
+
+    async def send(self, data, binary:bool=False):
+        """Sends str or bytes as a text message, or as binary message."""
+        if isinstance(data, str):
+            data = data.encode()
+        await self._send_frame(BINARY if binary else TEXT, data)
+
+    async def receive(self):
+        """Next message as str (text) or bytes (binary), None once the connection is closed."""
+        message = None
+        opcode = TEXT
+        while not self.closed:
+            try:
+                fin, frame_opcode, payload = await self._read_frame()
+            except ValueError as error:
+                await self.close(error.args[0])
+                return None
+            except (OSError, EOFError): # EOFError includes asyncio.IncompleteReadError
+                self.closed = True
+                return None
+            if frame_opcode == PING:
+                await self._send_frame(PONG, payload)
+                continue
+            if frame_opcode == PONG:
+                continue
+            if frame_opcode == CLOSE:
+                await self.close(struct.unpack("!H", payload)[0] if len(payload) >= 2 else CLOSE_NORMAL)
+                return None
+            if frame_opcode == CONTINUATION:
+                if message is None:
+                    await self.close(CLOSE_PROTOCOL_ERROR)
+                    return None
+                if len(message) + len(payload) > self.max_message:
+                    await self.close(CLOSE_TOO_BIG)
+                    return None
+                message += payload
+            elif message is not None:
+                await self.close(CLOSE_PROTOCOL_ERROR) # new message before the fragmented one ended
+                return None
+            else:
+                message = payload
+                opcode = frame_opcode
+            if fin:
+                if opcode != TEXT:
+                    return bytes(message)
+                try:
+                    return str(message, "utf-8")
+                except UnicodeError:
+                    await self.close(CLOSE_INVALID_DATA)
+                    return None
+        return None
+
+    async def close(self, code:int=CLOSE_NORMAL):
+        if self.closed:
+            return
+        self.closed = True
+        try:
+            await self._send_frame(CLOSE, struct.pack("!H", code))
+        except OSError:
+            pass # already gone